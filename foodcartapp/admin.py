@@ -1,14 +1,22 @@
 from django.contrib import admin
+from django.contrib import messages
 from django.http import HttpResponseRedirect
 from django.shortcuts import reverse
 from django.templatetags.static import static
 from django.utils.html import format_html
+from requests import RequestException
 
+from star_burger import settings
+
+from .image_variants import get_image_variant_url
+from .order_search import get_orders_lookup
 from .models import Product
 from .models import ProductCategory
 from .models import Restaurant
 from .models import RestaurantMenuItem
+from .search_index import get_product_index
 
+from .models import Job
 from .models import Order
 from .models import OrderItem
 
@@ -21,9 +29,24 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['firstname', 'lastname', 'phonenumber']
-    search_fields = ['firstname', 'lastname', 'phonenumber']
+    # Ищет get_search_results по проиндексированным ключам, а не icontains по всей истории заказов:
+    # телефон в любом формате или его начало, фамилия или фамилия и имя.
+    # Поля здесь нужны, чтобы админка показала строку поиска
+    search_fields = ['phone_key', 'name_key']
     inlines = [OrderItemInline]
-    readonly_fields = ['registration_date']
+    readonly_fields = ['registration_date', 'updated_at']
+    exclude = ['candidates_version']
+
+    def get_search_results(self, request, queryset, search_term):
+        lookup = get_orders_lookup(search_term)
+        if lookup is None:
+            return queryset, False
+        return queryset.filter(lookup), False
+
+    def save_model(self, request, obj, form, change):
+        if 'address' in form.changed_data:
+            obj.candidates_version = None
+        super().save_model(request, obj, form, change)
 
     def response_change(self, request, obj):
         if "_continue" not in request.POST and "_addanother" not in request.POST:
@@ -49,10 +72,23 @@ class RestaurantAdmin(admin.ModelAdmin):
         'address',
         'contact_phone',
     ]
+    readonly_fields = [
+        'lat',
+        'lon',
+    ]
     inlines = [
         RestaurantMenuItemInline
     ]
 
+    def save_model(self, request, obj, form, change):
+        if 'address' in form.changed_data or obj.coordinates is None:
+            try:
+                obj.geocode(settings.YANDEX_KEY)
+            except RequestException:
+                obj.lat, obj.lon = None, None
+                messages.warning(request, 'Не удалось определить координаты ресторана, попробуйте сохранить позже')
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -68,9 +104,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = [
         'category',
     ]
+    # Ищет get_search_results по индексу из search_index: SQLite не умеет сравнивать кириллицу без учёта регистра.
+    # Поля здесь нужны, чтобы админка показала строку поиска
     search_fields = [
-        # FIXME SQLite can not convert letter case for cyrillic words properly, so search will be buggy.
-        # Migration to PostgreSQL is necessary
         'name',
         'category__name',
     ]
@@ -103,6 +139,12 @@ class ProductAdmin(admin.ModelAdmin):
         'get_image_preview',
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        found = get_product_index().search(search_term)
+        return queryset.filter(pk__in=[product_id for product_id, _ in found]), False
+
     class Media:
         css = {
             "all": (
@@ -113,17 +155,29 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+        return format_html(
+            '<img src="{url}" style="max-height: 200px;"/>', url=get_image_variant_url(obj, 'list')
+        )
     get_image_preview.short_description = 'превью'
 
     def get_image_list_preview(self, obj):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
-        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.image.url)
+        return format_html(
+            '<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>',
+            edit_url=edit_url, src=get_image_variant_url(obj, 'preview'),
+        )
     get_image_list_preview.short_description = 'превью'
 
 
 @admin.register(ProductCategory)
 class ProductAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['locked_at', 'locked_by', 'last_error', 'created_at', 'finished_at']
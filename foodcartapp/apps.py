@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FoodcartappConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'foodcartapp'
+
+    def ready(self):
+        from foodcartapp import signals, tasks  # noqa: F401
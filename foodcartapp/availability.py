@@ -0,0 +1,173 @@
+import time
+
+from django.db import transaction
+
+from foodcartapp.cache_versions import VersionedCopy, bump_version, get_version
+
+
+MENU_VERSION_KEY = 'foodcartapp:menu_version'
+
+
+class MenuSnapshot:
+    """
+    Что сейчас в продаже: продукты по ресторанам и рестораны по продуктам.
+    Снимок не меняется после создания, изменения меню порождают новый снимок,
+    поэтому читать его можно из любых потоков без блокировок.
+    """
+
+    def __init__(self, version, menu_items=()):
+        """
+        :param version: версия меню, из которой собран снимок
+        :param menu_items: тройки (menu_item_id, product_id, restaurant_id) доступных пунктов меню
+        """
+        self.version = version
+        self.built_at = time.monotonic()
+        self.menu_items = {}
+        self.restaurants_by_product = {}
+        self.products_by_restaurant = {}
+        for menu_item_id, product_id, restaurant_id in menu_items:
+            self.menu_items[menu_item_id] = (product_id, restaurant_id)
+            self.restaurants_by_product.setdefault(product_id, set()).add(restaurant_id)
+            self.products_by_restaurant.setdefault(restaurant_id, set()).add(product_id)
+
+    @property
+    def available_products(self):
+        return self.restaurants_by_product.keys()
+
+    def copy(self, version):
+        snapshot = MenuSnapshot(version)
+        snapshot.built_at = self.built_at
+        snapshot.menu_items = dict(self.menu_items)
+        snapshot.restaurants_by_product = dict(self.restaurants_by_product)
+        snapshot.products_by_restaurant = dict(self.products_by_restaurant)
+        return snapshot
+
+    def _discard(self, index, key, value):
+        # Множества общие с предыдущим снимком, поэтому не меняем их, а подменяем копией
+        values = index.get(key, set()) - {value}
+        if values:
+            index[key] = values
+        else:
+            index.pop(key, None)
+
+    def add_menu_item(self, menu_item_id, product_id, restaurant_id):
+        self.remove_menu_item(menu_item_id)
+        self.menu_items[menu_item_id] = (product_id, restaurant_id)
+        self.restaurants_by_product[product_id] = {restaurant_id, *self.restaurants_by_product.get(product_id, ())}
+        self.products_by_restaurant[restaurant_id] = {product_id, *self.products_by_restaurant.get(restaurant_id, ())}
+
+    def remove_menu_item(self, menu_item_id):
+        if menu_item_id not in self.menu_items:
+            return
+        product_id, restaurant_id = self.menu_items.pop(menu_item_id)
+        self._discard(self.restaurants_by_product, product_id, restaurant_id)
+        self._discard(self.products_by_restaurant, restaurant_id, product_id)
+
+    def remove_product(self, product_id):
+        for restaurant_id in self.restaurants_by_product.pop(product_id, set()):
+            self._discard(self.products_by_restaurant, restaurant_id, product_id)
+        self.menu_items = {
+            menu_item_id: item for menu_item_id, item in self.menu_items.items() if item[0] != product_id
+        }
+
+    def remove_restaurant(self, restaurant_id):
+        for product_id in self.products_by_restaurant.pop(restaurant_id, set()):
+            self._discard(self.restaurants_by_product, product_id, restaurant_id)
+        self.menu_items = {
+            menu_item_id: item for menu_item_id, item in self.menu_items.items() if item[1] != restaurant_id
+        }
+
+
+def get_menu_version():
+    """
+    Возвращает общую для всех процессов версию меню
+    """
+    return get_version(MENU_VERSION_KEY)
+
+
+def bump_menu_version():
+    """
+    Сообщает всем процессам, что меню изменилось. Вызывайте после массовых
+    операций вроде queryset.update(), которые не отправляют сигналы моделей.
+    """
+    return bump_version(MENU_VERSION_KEY)
+
+
+def load_menu_snapshot(version):
+    from foodcartapp.models import RestaurantMenuItem
+
+    menu_items = RestaurantMenuItem.objects.filter(availability=True).values_list('id', 'product_id', 'restaurant_id')
+    return MenuSnapshot(version, menu_items)
+
+
+_snapshot = VersionedCopy(MENU_VERSION_KEY, load_menu_snapshot, 'MENU_SNAPSHOT_MAX_AGE')
+
+
+def get_menu_snapshot():
+    """
+    Возвращает актуальный снимок меню. База читается только если другой процесс
+    поменял меню или снимок устарел.
+    """
+    return _snapshot.get()
+
+
+def reset_menu_snapshot():
+    _snapshot.reset()
+
+
+def _apply_change(change):
+    def change_copy(snapshot, version):
+        snapshot = snapshot.copy(version)
+        change(snapshot)
+        return snapshot
+
+    _snapshot.apply_change(change_copy)
+
+
+def on_menu_item_saved(menu_item):
+    menu_item_id, product_id, restaurant_id = menu_item.id, menu_item.product_id, menu_item.restaurant_id
+    available = menu_item.availability
+
+    def change(snapshot):
+        if available:
+            snapshot.add_menu_item(menu_item_id, product_id, restaurant_id)
+        else:
+            snapshot.remove_menu_item(menu_item_id)
+
+    transaction.on_commit(lambda: _apply_change(change))
+
+
+def on_menu_item_deleted(menu_item_id):
+    transaction.on_commit(lambda: _apply_change(lambda snapshot: snapshot.remove_menu_item(menu_item_id)))
+
+
+def on_product_deleted(product_id):
+    transaction.on_commit(lambda: _apply_change(lambda snapshot: snapshot.remove_product(product_id)))
+
+
+def on_restaurant_deleted(restaurant_id):
+    transaction.on_commit(lambda: _apply_change(lambda snapshot: snapshot.remove_restaurant(restaurant_id)))
+
+
+def find_order_restaurants(product_ids, restaurants_by_product):
+    """
+    Возвращает рестораны, которые могут приготовить все продукты заказа
+    :param product_ids: id продуктов заказа
+    :param restaurants_by_product: словарь {product_id: {restaurant_id, ...}}
+    :return: множество id ресторанов
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return set()
+
+    # Начинаем с самого редкого продукта, чтобы пересечение сразу было маленьким
+    candidates = sorted(
+        (restaurants_by_product.get(product_id, set()) for product_id in product_ids),
+        key=len,
+    )
+    restaurant_ids = set(candidates[0])
+    for restaurants in candidates[1:]:
+        if not restaurant_ids:
+            break
+        restaurant_ids &= restaurants
+    return restaurant_ids
@@ -0,0 +1,188 @@
+import math
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from PIL import Image
+
+from foodcartapp import availability, geocoder, get_geo, search_index
+from foodcartapp.fake_geocoder import get_fake_coordinates, start_fake_geocoder
+from foodcartapp.models import Order, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from foodcartapp.spatial_index import reset_restaurant_index
+from star_burger import settings
+
+
+def reset_process_caches():
+    """
+    Сбрасывает всё, что процесс помнит о базе: кэш Django, снимок меню, индексы ресторанов и поиска, кэш координат
+    """
+    cache.clear()
+    availability.reset_menu_snapshot()
+    reset_restaurant_index()
+    search_index.reset_product_index()
+    geocoder.coordinates_cache.clear()
+    get_geo._session = None
+
+
+@contextmanager
+def isolated_environment():
+    """
+    Отдельная тестовая база, кэш в памяти, временный MEDIA_ROOT и поддельный геокодер.
+    Рабочие данные и Яндекс при прогонах не задеваются.
+    """
+    setup_test_environment(debug=False)
+    old_database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    server = start_fake_geocoder()
+    media_root = tempfile.TemporaryDirectory()
+    settings_override = override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        MEDIA_ROOT=media_root.name,
+    )
+    geocoder_patch = mock.patch.multiple(settings, GEOCODER_URL=server.url, GEOCODER_RETRY_BACKOFF=0)
+    settings_override.enable()
+    geocoder_patch.start()
+    try:
+        reset_process_caches()
+        yield server
+    finally:
+        geocoder_patch.stop()
+        settings_override.disable()
+        media_root.cleanup()
+        server.shutdown()
+        server.server_close()
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+        reset_process_caches()
+
+
+def seed_dataset(restaurants_count, products_count, menu_density, orders_count, seed=0):
+    """
+    Наполняет базу синтетическими данными. При одном и том же seed данные всегда одинаковые.
+    :param menu_density: доля продуктов, которые есть в меню каждого ресторана, от 0 до 1
+    :return: менеджер, от имени которого открывать страницы restaurateur
+    """
+    rng = random.Random(seed)
+
+    buffer = BytesIO()
+    Image.new('RGB', (600, 600), 'orange').save(buffer, 'JPEG')
+    image_name = Product._meta.get_field('image').storage.save('burger.jpg', ContentFile(buffer.getvalue()))
+
+    ProductCategory.objects.bulk_create([ProductCategory(name=f'Категория {number}') for number in range(5)])
+    categories = list(ProductCategory.objects.order_by('id'))
+    Product.objects.bulk_create([
+        Product(
+            name=f'Продукт {number}',
+            category=rng.choice(categories),
+            price=rng.randint(50, 900),
+            image=image_name,
+        )
+        for number in range(products_count)
+    ])
+    products = list(Product.objects.order_by('id'))
+
+    restaurants = []
+    for number in range(restaurants_count):
+        address = f'Москва, Ресторанная улица, {number}'
+        lon, lat = get_fake_coordinates(address)
+        restaurants.append(Restaurant(name=f'Ресторан {number}', address=address, lat=lat, lon=lon))
+    Restaurant.objects.bulk_create(restaurants)
+    restaurants = list(Restaurant.objects.order_by('id'))
+
+    RestaurantMenuItem.objects.bulk_create([
+        RestaurantMenuItem(restaurant=restaurant, product=product, availability=True)
+        for restaurant in restaurants
+        for product in products
+        if rng.random() < menu_density
+    ], batch_size=1000)
+
+    # Часть клиентов заказывает повторно на тот же адрес
+    addresses = [f'Москва, Клиентская улица, {number}' for number in range(max(orders_count // 2, 1))]
+    orders = [
+        Order(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address=rng.choice(addresses),
+            status=rng.choice([Order.NEW, Order.COOKING, Order.DELIVERY]),
+            totalprice=0,
+        )
+        for _ in range(orders_count)
+    ]
+    for order in orders:
+        order.update_search_keys()
+    Order.objects.bulk_create(orders, batch_size=1000)
+    items = []
+    for order in Order.objects.order_by('id'):
+        for product in rng.sample(products, k=min(rng.randint(1, 4), len(products))):
+            items.append(OrderItem(order=order, product=product, quantity=1, price=product.price))
+    OrderItem.objects.bulk_create(items, batch_size=1000)
+
+    # bulk_create не отправляет сигналы, поэтому снимок меню и индекс ресторанов сбрасываем сами
+    reset_process_caches()
+    return User.objects.create_user('bench-manager', is_staff=True)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def measure(run, repeat, warmup=1, before_each=None):
+    """
+    Замеряет функцию: время каждого вызова, число SQL-запросов и пиковую память
+    :param run: что замерять
+    :param repeat: сколько раз вызвать
+    :param warmup: сколько вызовов сделать до замеров, чтобы прогреть кэши
+    :param before_each: что сделать перед каждым вызовом, не попадает в замер
+    :return: словарь с перцентилями в миллисекундах, запросами и памятью в КБ
+    """
+    for _ in range(warmup):
+        if before_each:
+            before_each()
+        run()
+
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        with CaptureQueriesContext(connection) as context:
+            started_at = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started_at) * 1000)
+        queries.append(len(context.captured_queries))
+
+    # tracemalloc заметно замедляет код, поэтому память меряем отдельным вызовом
+    if before_each:
+        before_each()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
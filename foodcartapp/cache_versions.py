@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+from star_burger import settings
+
+
+def get_version(key):
+    """
+    Возвращает общую для всех процессов версию данных, которые процессы держат у себя в памяти.
+    Её дёшево опрашивать на каждом запросе: это одно чтение из кэша Django.
+    :param key: ключ версии в кэше
+    """
+    version = cache.get(key)
+    if version is None:
+        # Случайное начальное значение, чтобы после сброса кэша версия не совпала со старой
+        cache.add(key, uuid.uuid4().int % 2 ** 48, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Сообщает всем процессам, что данные изменились и их копии пора перечитать
+    :return: новая версия
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(key)
+        return cache.incr(key)
+
+
+class VersionedCopy:
+    """
+    Данные, которые каждый процесс держит у себя в памяти, а об их изменениях узнаёт по общей версии из кэша.
+    Копия перечитывается, если версия поменялась или копия старше max_age_setting: если кэш у каждого
+    процесса свой, о чужих изменениях иначе не узнать.
+    У копии должны быть атрибуты version и built_at — версия, из которой она собрана, и time.monotonic() сборки.
+    """
+
+    def __init__(self, version_key, load, max_age_setting):
+        """
+        :param version_key: ключ версии в кэше
+        :param load: функция, которая по версии собирает копию из базы
+        :param max_age_setting: имя настройки с возрастом копии в секундах
+        """
+        self.version_key = version_key
+        self.load = load
+        self.max_age_setting = max_age_setting
+        self._copy = None
+        self._lock = threading.Lock()
+
+    def is_expired(self, copy):
+        return time.monotonic() - copy.built_at > getattr(settings, self.max_age_setting)
+
+    def get(self):
+        version = get_version(self.version_key)
+        copy = self._copy
+        if copy is None or copy.version != version or self.is_expired(copy):
+            copy = self.load(version)
+            with self._lock:
+                self._copy = copy
+        return copy
+
+    def reset(self):
+        with self._lock:
+            self._copy = None
+
+    def invalidate(self):
+        """
+        Сообщает всем процессам, что данные изменились, а свою копию просто выбрасывает
+        """
+        bump_version(self.version_key)
+        self.reset()
+
+    def apply_change(self, change):
+        """
+        Сообщает всем процессам, что данные изменились, а свою копию обновляет без похода в базу
+        :param change: функция (копия, новая версия) → обновлённая копия с этой версией
+        """
+        with self._lock:
+            version = bump_version(self.version_key)
+            copy = self._copy
+            if copy is not None and copy.version == version - 1:
+                self._copy = change(copy, version)
+            else:
+                # Пока мы меняли данные, их поменял кто-то ещё — проще перечитать из базы
+                self._copy = None
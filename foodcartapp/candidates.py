@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.db import transaction
+from requests import RequestException
+
+from foodcartapp.availability import find_order_restaurants, get_menu_snapshot
+from foodcartapp.models import Order, OrderCandidate
+from foodcartapp.place_distances import get_restaurant_distances
+from star_burger import settings
+
+
+def refresh_order_candidates(orders, force=False):
+    """
+    Возвращает рестораны, которые могут выполнить заказы, пересчитывая только устаревшие.
+    Заказ устарел, если у него поменялись позиции или адрес (тогда candidates_version сброшен в None)
+    или если после прошлого расчёта поменялось меню и это затронуло нужные заказу продукты.
+    :param orders: заказы с предзагруженными items и candidates
+    :param force: пересчитать всё, не глядя на версии
+    :return: словарь {order_id: [OrderCandidate, ...]}
+    """
+    menu = get_menu_snapshot()
+    orders_candidates = {}
+    stale_orders = []
+    unchanged_order_ids = []
+    for order in orders:
+        stored_candidates = list(order.candidates.all())
+        if not force and order.candidates_version == menu.version:
+            orders_candidates[order.id] = stored_candidates
+            continue
+
+        product_ids = {item.product_id for item in order.items.all()}
+        restaurant_ids = find_order_restaurants(product_ids, menu.restaurants_by_product)
+        stored_ids = {candidate.restaurant_id for candidate in stored_candidates}
+        if not force and order.candidates_version is not None and restaurant_ids == stored_ids:
+            # Меню менялось, но не для продуктов этого заказа — расстояния остаются прежними
+            orders_candidates[order.id] = stored_candidates
+            unchanged_order_ids.append(order.id)
+        else:
+            stale_orders.append((order, restaurant_ids))
+        order.candidates_version = menu.version
+
+    if unchanged_order_ids:
+        Order.objects.filter(id__in=unchanged_order_ids).update(candidates_version=menu.version)
+    if stale_orders:
+        orders_candidates.update(_compute_candidates(stale_orders, menu.version))
+    return orders_candidates
+
+
+def _compute_candidates(stale_orders, version):
+    restaurants_by_address = defaultdict(set)
+    for order, restaurant_ids in stale_orders:
+        restaurants_by_address[order.address] |= restaurant_ids
+    try:
+        address_distances = get_restaurant_distances(restaurants_by_address)
+    except RequestException:
+        address_distances = {}
+
+    orders_candidates = {}
+    resolved_order_ids = []
+    unresolved_order_ids = []
+    for order, restaurant_ids in stale_orders:
+        distances = address_distances.get(order.address)
+        if distances is None:
+            # Без ответа геокодера показываем рестораны без расстояний, но не запоминаем их,
+            # чтобы следующий запрос посчитал расстояния заново
+            unresolved_order_ids.append(order.id)
+            order.candidates_version = None
+            distances = {}
+        else:
+            resolved_order_ids.append(order.id)
+        orders_candidates[order.id] = [
+            OrderCandidate(order=order, restaurant_id=restaurant_id, distance=distances.get(restaurant_id))
+            for restaurant_id in restaurant_ids
+        ]
+
+    with transaction.atomic():
+        OrderCandidate.objects.filter(order_id__in=resolved_order_ids).delete()
+        OrderCandidate.objects.bulk_create([
+            candidate
+            for order_id in resolved_order_ids
+            for candidate in orders_candidates[order_id]
+        ])
+        Order.objects.filter(id__in=resolved_order_ids).update(candidates_version=version)
+        if unresolved_order_ids:
+            Order.objects.filter(id__in=unresolved_order_ids).update(candidates_version=None)
+    return orders_candidates
+
+
+def select_nearest(candidates):
+    """
+    Оставляет рестораны в радиусе доставки, ближние вперёд, без известного расстояния — в конце
+    """
+    located = sorted(
+        (candidate for candidate in candidates if candidate.distance is not None),
+        key=lambda candidate: candidate.distance,
+    )
+    if settings.DELIVERY_RADIUS_KM is not None:
+        located = [candidate for candidate in located if candidate.distance <= settings.DELIVERY_RADIUS_KM]
+    if settings.ORDER_CANDIDATES_LIMIT is not None:
+        located = located[:settings.ORDER_CANDIDATES_LIMIT]
+    return located + [candidate for candidate in candidates if candidate.distance is None]
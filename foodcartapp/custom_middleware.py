@@ -1,9 +1,18 @@
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
 from django.http import HttpResponseForbidden
 from django.utils.http import url_has_allowed_host_and_scheme
 
+from foodcartapp import metrics
 from star_burger import settings
 
 
+logger = logging.getLogger(__name__)
+
+
 class URLProtectionMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -15,3 +24,72 @@ class URLProtectionMiddleware:
 
         response = self.get_response(request)
         return response
+
+
+def get_view_label(resolver_match):
+    if resolver_match is None:
+        return 'unmatched'
+    if resolver_match.url_name:
+        return resolver_match.view_name
+    # У безымянных маршрутов вроде /api/products/ подписываем метрику путём до функции вьюхи
+    return f'{resolver_match.func.__module__}.{resolver_match.func.__name__}'
+
+
+class MetricsMiddleware:
+    """
+    Засекает время каждой вьюхи, её SQL-запросы и обращения к геокодеру и складывает в метрики, см. /metrics.
+    Ставьте первым в MIDDLEWARE, чтобы в замер попало и время остальных middleware.
+    Потоковые ответы вьюха только начинает, а работают они, пока сервер отдаёт тело,
+    поэтому их замеряем до конца потока.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started_at = time.perf_counter()
+        stats = metrics.RequestStats()
+        with self.measure(stats):
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self.measure_stream(
+                request, response, iter(response.streaming_content), started_at, stats,
+            )
+        else:
+            self.record(request, response, time.perf_counter() - started_at, stats)
+        return response
+
+    @contextmanager
+    def measure(self, stats):
+        with metrics.collect_request_stats(stats), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats.record_query))
+            yield
+
+    def measure_stream(self, request, response, chunks, started_at, stats):
+        try:
+            while True:
+                # Счётчики привязываем только на время очередного куска: между кусками поток отдаёт их серверу
+                with self.measure(stats):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # Клиент мог отключиться посреди потока, тогда исходный генератор тоже надо закрыть
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self.record(request, response, time.perf_counter() - started_at, stats)
+
+    def record(self, request, response, duration, stats):
+        view = get_view_label(request.resolver_match)
+        metrics.record_request(view, request.method, response.status_code, duration, stats)
+
+        threshold = settings.SLOW_REQUEST_THRESHOLD_MS
+        if threshold is not None and duration * 1000 >= threshold:
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.0f мс, SQL: %s запросов за %.0f мс, геокодер: %s запросов за %.0f мс',
+                request.method, request.path, view, duration * 1000,
+                stats.queries, stats.query_seconds * 1000, stats.geocoder_calls, stats.geocoder_seconds * 1000,
+            )
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def get_fake_coordinates(address):
+    """
+    Детерминированно превращает адрес в точку в окрестностях Москвы
+    :param address: адрес
+    :return: (lon, lat)
+    """
+    digest = hashlib.sha256(address.encode()).digest()
+    lon = 37.3 + int.from_bytes(digest[:4], 'big') / 2 ** 32 * 0.6
+    lat = 55.5 + int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 0.4
+    return round(lon, 6), round(lat, 6)
+
+
+class FakeGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests_count += 1
+            failing = server.failures_left > 0
+            if failing:
+                server.failures_left -= 1
+
+        if failing:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        address = parse_qs(urlparse(self.path).query).get('geocode', [''])[0]
+        if address in server.unknown_addresses:
+            found_places = []
+        else:
+            lon, lat = get_fake_coordinates(address)
+            found_places = [{'GeoObject': {'Point': {'pos': f'{lon} {lat}'}}}]
+
+        body = json.dumps({
+            'response': {'GeoObjectCollection': {'featureMember': found_places}},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_geocoder(host='127.0.0.1', port=0, unknown_addresses=(), failures=0):
+    """
+    Поднимает в отдельном потоке сервер, который отвечает как геокодер Яндекса.
+    Нужен для тестов, бенчмарков и нагрузочных прогонов без похода в интернет.
+    :param unknown_addresses: адреса, которые «не находятся»
+    :param failures: сколько первых запросов ответить ошибкой 503
+    :return: запущенный сервер, его адрес лежит в server.url
+    """
+    server = ThreadingHTTPServer((host, port), FakeGeocoderHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests_count = 0
+    server.failures_left = failures
+    server.unknown_addresses = set(unknown_addresses)
+    server.url = f'http://{host}:{server.server_address[1]}/1.x'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
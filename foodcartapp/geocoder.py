@@ -0,0 +1,160 @@
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.utils import timezone
+
+from foodcartapp.get_geo import fetch_coordinates, fetch_coordinates_batch
+from foodcartapp.lru_cache import LRUCache
+from star_burger import settings
+
+
+# Кэш устроен в два уровня: LRU в памяти процесса, за ним таблица Place.
+# Адреса, которые геокодер не нашёл, тоже запоминаются, но на меньший срок.
+coordinates_cache = LRUCache(maxsize=settings.GEOCODER_CACHE_SIZE)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def get_stats():
+    """
+    Возвращает счётчики кэша геокодера
+    :return: словарь {событие: количество}
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['memory_hits'] = coordinates_cache.hits
+    stats['memory_misses'] = coordinates_cache.misses
+    return stats
+
+
+def normalize_address(address):
+    return ' '.join(address.split())
+
+
+def _get_ttl(coordinates):
+    if coordinates is None:
+        return settings.GEOCODER_NEGATIVE_CACHE_TTL
+    return settings.GEOCODER_CACHE_TTL
+
+
+def _remember(address, coordinates, updated_at):
+    expires_at = updated_at + timedelta(seconds=_get_ttl(coordinates))
+    ttl = (expires_at - timezone.now()).total_seconds()
+    if ttl > 0:
+        coordinates_cache.set(address, coordinates, ttl=ttl)
+
+
+def _is_fresh(place):
+    return place.updated_at + timedelta(seconds=_get_ttl(place.coordinates)) > timezone.now()
+
+
+def _load_place(address):
+    from foodcartapp.models import Place
+
+    place = Place.objects.filter(name=address).first()
+    if place is None:
+        return LRUCache.MISSING
+    coordinates = place.coordinates
+    if not _is_fresh(place):
+        _count('db_expired')
+        return LRUCache.MISSING
+    _count('db_hits')
+    _remember(address, coordinates, place.updated_at)
+    return coordinates
+
+
+def save_coordinates(address, coordinates):
+    """
+    Сохраняет ответ геокодера в оба уровня кэша
+    :param address: нормализованный адрес
+    :param coordinates: (lat, lon) или None, если адрес не найден
+    """
+    from foodcartapp.models import Place, PlaceDistance
+
+    lat, lon = coordinates if coordinates else (None, None)
+    previous_coordinates = Place.objects.filter(name=address).values_list('lat', 'lon').first()
+    place, _ = Place.objects.update_or_create(name=address, defaults={'lat': lat, 'lon': lon})
+    if previous_coordinates is not None and previous_coordinates != (lat, lon):
+        # Геокодер передвинул адрес, посчитанные от старой точки расстояния больше не верны
+        PlaceDistance.objects.filter(place=place).delete()
+    _remember(address, coordinates, place.updated_at)
+
+
+def get_coordinates(apikey, address):
+    """
+    Возвращает координаты адреса, по возможности не обращаясь к геокодеру
+    :param apikey: ключ для yandex api
+    :param address: адрес
+    :return: (lat, lon) или None, если геокодер не нашёл адрес
+    """
+    address = normalize_address(address)
+    coordinates = coordinates_cache.get(address, LRUCache.MISSING)
+    if coordinates is not LRUCache.MISSING:
+        return coordinates
+
+    coordinates = _load_place(address)
+    if coordinates is not LRUCache.MISSING:
+        return coordinates
+
+    _count('geocoder_calls')
+    coordinates = _to_lat_lon(fetch_coordinates(apikey, address))
+    save_coordinates(address, coordinates)
+    return coordinates
+
+
+def get_coordinates_many(apikey, addresses):
+    """
+    Возвращает координаты сразу для многих адресов. Адреса, которых нет в кэше,
+    геокодируются параллельно, а свежие записи Place читаются одним запросом.
+    :param apikey: ключ для yandex api
+    :param addresses: адреса
+    :return: словарь {адрес: (lat, lon) или None, если геокодер не нашёл адрес}; адреса, на которых
+        геокодер так и не ответил, в словарь не попадают
+    """
+    from foodcartapp.models import Place
+
+    normalized_addresses = {address: normalize_address(address) for address in addresses}
+    found_coordinates = {}
+    for address in set(normalized_addresses.values()):
+        coordinates = coordinates_cache.get(address, LRUCache.MISSING)
+        if coordinates is not LRUCache.MISSING:
+            found_coordinates[address] = coordinates
+
+    missing_addresses = set(normalized_addresses.values()) - set(found_coordinates)
+    for place in Place.objects.filter(name__in=missing_addresses):
+        if not _is_fresh(place):
+            _count('db_expired')
+            continue
+        _count('db_hits')
+        _remember(place.name, place.coordinates, place.updated_at)
+        found_coordinates[place.name] = place.coordinates
+
+    missing_addresses -= set(found_coordinates)
+    if missing_addresses:
+        with _stats_lock:
+            _stats['geocoder_calls'] += len(missing_addresses)
+        for address, found in fetch_coordinates_batch(apikey, missing_addresses).items():
+            coordinates = _to_lat_lon(found)
+            save_coordinates(address, coordinates)
+            found_coordinates[address] = coordinates
+
+    return {
+        address: found_coordinates[normalized_address]
+        for address, normalized_address in normalized_addresses.items()
+        if normalized_address in found_coordinates
+    }
+
+
+def _to_lat_lon(found):
+    if found is None:
+        _count('geocoder_not_found')
+        return None
+    lon, lat = found
+    return lat, lon
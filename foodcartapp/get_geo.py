@@ -1,19 +1,96 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from foodcartapp import metrics
+from star_burger import settings
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Возвращает общую keep-alive сессию для запросов к геокодеру.
+    Сессия держит пул соединений и сама повторяет упавшие запросы с нарастающей паузой.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=settings.GEOCODER_RETRIES,
+                backoff_factor=settings.GEOCODER_RETRY_BACKOFF,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET'],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.GEOCODER_MAX_WORKERS,
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
 
 
 def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        'geocode': address,
-        'apikey': apikey,
-        'format': 'json'
-    })
-    response.raise_for_status()
-    found_places = response.json()['response']['GeoObjectCollection']['featureMember']
-
-    if not found_places:
-        return None
-
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].slit(' ')
-    return lon, lat
+    started_at = time.perf_counter()
+    outcome = 'error'
+    try:
+        response = get_session().get(settings.GEOCODER_URL, params={
+            'geocode': address,
+            'apikey': apikey,
+            'format': 'json'
+        }, timeout=settings.GEOCODER_TIMEOUT)
+        response.raise_for_status()
+        found_places = response.json()['response']['GeoObjectCollection']['featureMember']
+
+        if not found_places:
+            outcome = 'not_found'
+            return None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(' ')
+        outcome = 'found'
+        return float(lon), float(lat)
+    finally:
+        metrics.record_geocoder_call(time.perf_counter() - started_at, outcome)
+
+
+def fetch_coordinates_batch(apikey, addresses):
+    """
+    Геокодирует адреса параллельно на ограниченном пуле потоков
+    :param apikey: ключ для yandex api
+    :param addresses: адреса
+    :return: словарь {адрес: (lon, lat) или None}; адреса, на которых геокодер
+        так и не ответил, в словарь не попадают
+    """
+    addresses = list(dict.fromkeys(addresses))
+    if not addresses:
+        return {}
+
+    request_stats = metrics.get_request_stats()
+
+    def fetch(address):
+        # Запросы из пула потоков тоже засчитываем HTTP-запросу, который их породил
+        with metrics.collect_request_stats(request_stats):
+            try:
+                return address, fetch_coordinates(apikey, address), None
+            except requests.RequestException as error:
+                return address, None, error
+
+    found_coordinates = {}
+    max_workers = min(settings.GEOCODER_MAX_WORKERS, len(addresses))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for address, coordinates, error in executor.map(fetch, addresses):
+            if error is None:
+                found_coordinates[address] = coordinates
+    return found_coordinates
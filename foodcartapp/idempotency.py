@@ -0,0 +1,98 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from foodcartapp.lru_cache import LRUCache
+from foodcartapp.models import IdempotencyKey
+from star_burger import settings
+
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+# Повторы обычно приходят в тот же процесс через секунды, поэтому сначала смотрим в память
+responses_cache = LRUCache(maxsize=settings.IDEMPOTENCY_CACHE_SIZE, ttl=settings.IDEMPOTENCY_KEY_TTL)
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Ключ уже использован для запроса с другим телом
+    """
+
+
+def get_expiration_date():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def get_request_hash(data):
+    """
+    :param data: разобранное тело запроса
+    :return: SHA-256 тела, не зависящий от порядка полей и пробелов
+    """
+    content = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def remember(stored):
+    # Ключ живёт IDEMPOTENCY_KEY_TTL с момента создания, а не с момента, когда его прочитали из базы
+    age = (timezone.now() - stored.created_at).total_seconds()
+    ttl = max(settings.IDEMPOTENCY_KEY_TTL - age, 0)
+    responses_cache.set(stored.key, (stored.request_hash, stored.response), ttl=ttl)
+
+
+def check_request_hash(stored_hash, request_hash):
+    if stored_hash != request_hash:
+        raise IdempotencyKeyReused()
+
+
+def get_stored_response(key, request_hash):
+    """
+    Возвращает ответ, который уже отдали на запрос с этим ключом
+    :param key: значение заголовка Idempotency-Key
+    :param request_hash: хеш тела запроса, см. get_request_hash
+    :return: данные ответа или None, если запроса с таким ключом не было
+    :raises IdempotencyKeyReused: если с этим ключом приходил запрос с другим телом
+    """
+    cached = responses_cache.get(key)
+    if cached is not None:
+        stored_hash, response = cached
+        check_request_hash(stored_hash, request_hash)
+        return response
+
+    stored = IdempotencyKey.objects.filter(key=key).first()
+    if stored is None:
+        return None
+    if stored.created_at < get_expiration_date():
+        stored.delete()
+        return None
+    remember(stored)
+    check_request_hash(stored.request_hash, request_hash)
+    return stored.response
+
+
+def run_once(key, request_hash, handler):
+    """
+    Выполняет handler и запоминает его ответ под ключом. Если параллельный запрос
+    с тем же ключом успел раньше, всё сделанное handler откатывается.
+    :param key: значение заголовка Idempotency-Key
+    :param request_hash: хеш тела запроса, см. get_request_hash
+    :param handler: функция без аргументов, возвращающая данные ответа
+    :return: (данные ответа, True если handler действительно отработал)
+    :raises IdempotencyKeyReused: если параллельный запрос с этим ключом пришёл с другим телом
+    """
+    try:
+        with transaction.atomic():
+            response = handler()
+            stored = IdempotencyKey.objects.create(key=key, request_hash=request_hash, response=response)
+    except IntegrityError:
+        stored = IdempotencyKey.objects.filter(key=key).first()
+        if stored is None:
+            raise
+        remember(stored)
+        check_request_hash(stored.request_hash, request_hash)
+        return stored.response, False
+
+    remember(stored)
+    return response, True
@@ -0,0 +1,119 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from foodcartapp.models import Product
+
+
+# Размеры, в которые вписываются уменьшенные копии. Превью в списке админки 50px,
+# берём вдвое больше для экранов с высокой плотностью пикселей
+IMAGE_VARIANTS = {
+    'preview': (100, 100),
+    'list': (300, 300),
+    'card': (800, 800),
+}
+VARIANTS_DIR = 'variants'
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 6},
+}
+
+
+def encode_image(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def build_image_variants(image):
+    """
+    Делает уменьшенные копии картинки в её формате и в WebP.
+    Имена файлов зависят только от содержимого картинки и размера, поэтому одну и ту же
+    картинку не пережимаем дважды, а сами файлы браузеры могут кэшировать сколько угодно.
+    :param image: файл из ImageField
+    :return: словарь {'source': имя исходной картинки, вариант: {формат: имя файла}}
+    """
+    with image.open('rb'):
+        content = image.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    source = Image.open(BytesIO(content))
+    source_format = 'PNG' if source.format == 'PNG' else 'JPEG'
+    # Телефоны пишут поворот снимка в EXIF, а копии сохраняются уже без него
+    source = ImageOps.exif_transpose(source)
+
+    variants = {'source': image.name}
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = None
+        variants[variant] = {}
+        for image_format in (source_format, 'WEBP'):
+            name = f'{VARIANTS_DIR}/{digest[:2]}/{digest}_{size[0]}x{size[1]}.{image_format.lower()}'
+            if not default_storage.exists(name):
+                if resized is None:
+                    resized = source.copy()
+                    resized.thumbnail(size, Image.LANCZOS)
+                name = default_storage.save(name, ContentFile(encode_image(resized, image_format)))
+            variants[variant][image_format.lower()] = name
+    return variants
+
+
+def has_image_variants(product):
+    return bool(product.image) and product.image_variants.get('source') == product.image.name
+
+
+def make_image_variants(product):
+    """
+    Делает уменьшенные копии картинки продукта, если их ещё нет. Pillow работает долго,
+    поэтому вызывается из воркера, см. задачу build_image_variants
+    :param product: продукт
+    :return: True, если копии появились только что
+    """
+    if not product.image or has_image_variants(product):
+        return False
+    try:
+        variants = build_image_variants(product.image)
+    except OSError:
+        return False
+    Product.objects.filter(pk=product.pk).update(image_variants=variants)
+    product.image_variants = variants
+    return True
+
+
+def get_image_variants(product):
+    """
+    Возвращает уменьшенные копии картинки продукта. Сами копии готовит воркер,
+    а пока их нет, показывается исходная картинка
+    :param product: продукт
+    :return: словарь {вариант: {формат: имя файла}}, пустой, если копий ещё нет
+    """
+    if not has_image_variants(product):
+        return {}
+    return {
+        variant: files
+        for variant, files in product.image_variants.items()
+        if variant in IMAGE_VARIANTS
+    }
+
+
+def get_image_variant_urls(product):
+    return {
+        variant: {image_format: default_storage.url(name) for image_format, name in files.items()}
+        for variant, files in get_image_variants(product).items()
+    }
+
+
+def get_image_variant_url(product, variant):
+    """
+    Ссылка на уменьшенную копию картинки в её исходном формате, а если копии нет — на саму картинку
+    """
+    files = get_image_variants(product).get(variant)
+    if not files:
+        return product.image.url
+    image_format = next(image_format for image_format in files if image_format != 'webp')
+    return default_storage.url(files[image_format])
@@ -0,0 +1,113 @@
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from foodcartapp.models import Job
+from star_burger import settings
+
+
+handlers = {}
+
+
+def job(name):
+    """
+    Регистрирует функцию как обработчик фоновой задачи
+    :param name: имя задачи, под которым её ставят в очередь
+    """
+    def register(handler):
+        handlers[name] = handler
+        return handler
+    return register
+
+
+def enqueue(name, **payload):
+    """
+    Ставит задачу в очередь. Задача пишется в ту же транзакцию, что и вызывающий код,
+    поэтому воркер не увидит её, пока транзакция не закоммичена.
+    """
+    return Job.objects.create(name=name, payload=payload)
+
+
+def enqueue_many(name, payloads):
+    return Job.objects.bulk_create([Job(name=name, payload=payload) for payload in payloads])
+
+
+def claim_jobs(limit, worker_id):
+    """
+    Забирает задачи из очереди так, чтобы два воркера не взяли одну и ту же.
+    Задачи упавших воркеров возвращаются в работу по таймауту.
+    :return: список задач, закреплённых за worker_id
+    """
+    now = timezone.now()
+    ready = Q(status=Job.PENDING, run_after__lte=now)
+    abandoned = Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+
+    with transaction.atomic():
+        job_ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(ready | abandoned)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        # Условие повторяем в UPDATE: на базах без SELECT FOR UPDATE задачу заберёт только один воркер
+        Job.objects.filter(ready | abandoned, id__in=job_ids).update(
+            status=Job.RUNNING,
+            locked_at=now,
+            locked_by=worker_id,
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(id__in=job_ids, status=Job.RUNNING, locked_by=worker_id))
+
+
+def run_job(job_to_run):
+    handler = handlers.get(job_to_run.name)
+    try:
+        if handler is None:
+            raise LookupError(f'Нет обработчика для задачи «{job_to_run.name}»')
+        handler(**job_to_run.payload)
+    except Exception:
+        job_to_run.last_error = traceback.format_exc()
+        if job_to_run.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job_to_run.status = Job.FAILED
+        else:
+            job_to_run.status = Job.PENDING
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job_to_run.attempts - 1)
+            job_to_run.run_after = timezone.now() + timedelta(seconds=delay)
+    else:
+        job_to_run.status = Job.DONE
+    if job_to_run.status in (Job.DONE, Job.FAILED):
+        job_to_run.finished_at = timezone.now()
+    job_to_run.locked_at = None
+    job_to_run.save(update_fields=['status', 'run_after', 'locked_at', 'last_error', 'finished_at'])
+    return job_to_run.status
+
+
+def run_pending_jobs(limit=10, worker_id=None):
+    """
+    Выполняет пачку задач из очереди
+    :return: сколько задач взято в работу
+    """
+    worker_id = worker_id or uuid.uuid4().hex
+    claimed_jobs = claim_jobs(limit, worker_id)
+    for claimed_job in claimed_jobs:
+        run_job(claimed_job)
+    return len(claimed_jobs)
+
+
+def delete_finished_jobs(days=None):
+    """
+    Удаляет выполненные и окончательно упавшие задачи: каждый заказ ставит хотя бы одну задачу,
+    и без чистки таблица растёт бесконечно
+    :param days: сколько дней хранить завершённые задачи, по умолчанию JOB_RETENTION_DAYS
+    :return: сколько задач удалено
+    """
+    days = settings.JOB_RETENTION_DAYS if days is None else days
+    deleted, _ = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED],
+        finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return deleted
@@ -0,0 +1,202 @@
+import json
+import queue
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+from foodcartapp.availability import get_menu_snapshot
+from foodcartapp.benchmarks import percentile
+
+
+def build_corpus(count, order_share=0.2, banner_share=0.1, addresses_count=100, seed=0):
+    """
+    Собирает корпус запросов, похожий на живой трафик: в основном каталог, иногда баннеры и заказы.
+    В заказы попадают только товары, которые сейчас есть в меню, иначе они не пройдут проверку.
+    :param order_share: доля оформлений заказа
+    :param banner_share: доля запросов баннеров
+    :param addresses_count: сколько разных адресов у клиентов, повторные адреса попадают в кэш координат
+    :return: список запросов в формате, который понимает replay
+    """
+    rng = random.Random(seed)
+    product_ids = sorted(get_menu_snapshot().available_products)
+    if not product_ids and order_share:
+        raise ValueError('Нет ни одного товара в меню ресторанов, заказы собрать не из чего')
+
+    addresses = [f'Москва, Клиентская улица, {number}' for number in range(addresses_count)]
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < order_share:
+            corpus.append({
+                'name': 'register_order',
+                'method': 'POST',
+                'path': '/api/order/',
+                'json': {
+                    'products': [
+                        {'product': product_id, 'quantity': rng.randint(1, 3)}
+                        for product_id in rng.sample(product_ids, k=min(rng.randint(1, 4), len(product_ids)))
+                    ],
+                    'firstname': 'Иван',
+                    'lastname': 'Петров',
+                    'phonenumber': '+79991234567',
+                    'address': rng.choice(addresses),
+                },
+            })
+        elif roll < order_share + banner_share:
+            corpus.append({'name': 'banners_list_api', 'method': 'GET', 'path': '/api/banners/'})
+        else:
+            corpus.append({'name': 'product_list_api', 'method': 'GET', 'path': '/api/products/'})
+    return corpus
+
+
+def read_corpus(lines):
+    """
+    :param lines: строки JSON Lines, пустые пропускаются
+    :return: список запросов
+    """
+    corpus = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f'Строка {number}: {error}')
+        if not isinstance(entry, dict) or 'path' not in entry:
+            raise ValueError(f'Строка {number}: ожидается объект хотя бы с полем path')
+        corpus.append(entry)
+    return corpus
+
+
+def get_arrival_times(count, rate, arrival='poisson', seed=0):
+    """
+    Когда отправлять запросы, в секундах от начала прогона.
+    Время прихода не зависит от того, как быстро отвечает сервер, поэтому очередь растёт, когда он не успевает.
+    :param rate: запросов в секунду
+    :param arrival: poisson — случайные промежутки, как у независимых клиентов, constant — ровные
+    """
+    rng = random.Random(seed)
+    arrival_times = []
+    moment = 0
+    for _ in range(count):
+        arrival_times.append(moment)
+        moment += rng.expovariate(rate) if arrival == 'poisson' else 1 / rate
+    return arrival_times
+
+
+def send(session, base_url, entry, timeout, idempotency):
+    method = entry.get('method', 'GET').upper()
+    headers = dict(entry.get('headers', {}))
+    if idempotency and method == 'POST':
+        headers['Idempotency-Key'] = str(uuid.uuid4())
+    try:
+        response = session.request(
+            method, base_url.rstrip('/') + entry['path'], json=entry.get('json'), headers=headers, timeout=timeout,
+        )
+        # Тело читаем целиком: без этого замер не учитывает передачу ответа
+        response.content
+        return response.status_code
+    except requests.RequestException as error:
+        return type(error).__name__
+
+
+def replay(corpus, base_url, concurrency, requests_count=None, rate=None, arrival='poisson', timeout=10,
+           idempotency=False, seed=0):
+    """
+    Проигрывает корпус против запущенного сайта.
+    Без rate каждый поток шлёт следующий запрос сразу после ответа на предыдущий,
+    так видно потолок пропускной способности.
+    С rate запросы приходят в заданном темпе, и время ответа считается от момента, когда запрос должен был уйти,
+    так что ожидание в очереди перегруженного сервера тоже попадает в замер.
+    :param corpus: запросы, по кругу, если requests_count больше корпуса
+    :param base_url: адрес сайта, например http://127.0.0.1:8000
+    :param concurrency: сколько запросов может быть в полёте одновременно
+    :param requests_count: сколько запросов отправить, по умолчанию весь корпус один раз
+    :param rate: запросов в секунду
+    :param idempotency: добавлять к каждому POST новый Idempotency-Key
+    :return: (список (имя запроса, статус или название ошибки, время ответа в секундах), длительность прогона)
+    """
+    requests_count = len(corpus) if requests_count is None else requests_count
+    entries = [corpus[index % len(corpus)] for index in range(requests_count)]
+    pending = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+
+    def work():
+        with requests.Session() as session:
+            while True:
+                task = pending.get()
+                if task is None:
+                    return
+                entry, scheduled_at = task
+                sent_at = time.perf_counter()
+                status = send(session, base_url, entry, timeout, idempotency)
+                duration = time.perf_counter() - (scheduled_at or sent_at)
+                with results_lock:
+                    results.append((entry.get('name', entry['path']), status, duration))
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.start()
+
+    if rate:
+        for entry, arrival_time in zip(entries, get_arrival_times(len(entries), rate, arrival, seed)):
+            scheduled_at = started_at + arrival_time
+            time.sleep(max(scheduled_at - time.perf_counter(), 0))
+            pending.put((entry, scheduled_at))
+    else:
+        for entry in entries:
+            pending.put((entry, None))
+
+    for _ in workers:
+        pending.put(None)
+    for worker in workers:
+        worker.join()
+    return results, time.perf_counter() - started_at
+
+
+def summarize_timings(results, elapsed):
+    timings = [duration * 1000 for _, _, duration in results]
+    statuses = Counter(str(status) for _, status, _ in results)
+    errors = sum(
+        count for status, count in statuses.items()
+        if not status.isdigit() or int(status) >= 400
+    )
+    return {
+        'requests': len(results),
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed else None,
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4),
+        'statuses': dict(sorted(statuses.items())),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'p999_ms': round(percentile(timings, 99.9), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def summarize(results, elapsed):
+    """
+    :return: пропускная способность, ошибки и перцентили времени ответа, всего и по каждому виду запросов
+    """
+    if not results:
+        return {'elapsed_s': round(elapsed, 3), 'total': None, 'by_name': {}}
+    results_by_name = {}
+    for result in results:
+        results_by_name.setdefault(result[0], []).append(result)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize_timings(results, elapsed),
+        'by_name': {
+            name: summarize_timings(name_results, elapsed)
+            for name, name_results in sorted(results_by_name.items())
+        },
+    }
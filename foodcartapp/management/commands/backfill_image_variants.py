@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.image_variants import has_image_variants
+from foodcartapp.jobs import enqueue_many
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь уменьшенные копии картинок для товаров, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько товаров читать за раз')
+
+    def handle(self, *args, **options):
+        enqueued_count = 0
+        last_id = 0
+        while True:
+            products = list(
+                Product.objects.filter(pk__gt=last_id).exclude(image='').order_by('pk').only(
+                    'id', 'image', 'image_variants',
+                )[:options['batch_size']]
+            )
+            if not products:
+                break
+            last_id = products[-1].pk
+
+            # Сами картинки пережимает воркер run_jobs, чтобы команда не мешала сайту
+            payloads = [{'product_id': product.id} for product in products if not has_image_variants(product)]
+            enqueue_many('build_image_variants', payloads)
+            enqueued_count += len(payloads)
+
+        self.stdout.write(f'Поставлено в очередь товаров: {enqueued_count}')
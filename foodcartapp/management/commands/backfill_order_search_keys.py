@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Заполняет у старых заказов ключи для поиска по телефону и имени в админке'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько заказов обновлять за раз')
+
+    def handle(self, *args, **options):
+        updated_count = 0
+        last_id = 0
+        while True:
+            # Идём по id, а не по OFFSET, чтобы каждая пачка читалась по индексу
+            orders = list(
+                Order.objects.filter(pk__gt=last_id).order_by('pk').only(
+                    'id', 'firstname', 'lastname', 'phonenumber', 'phone_key', 'name_key',
+                )[:options['batch_size']]
+            )
+            if not orders:
+                break
+            last_id = orders[-1].pk
+
+            changed_orders = []
+            for order in orders:
+                keys = (order.phone_key, order.name_key)
+                order.update_search_keys()
+                if (order.phone_key, order.name_key) != keys:
+                    changed_orders.append(order)
+            Order.objects.bulk_update(changed_orders, ['phone_key', 'name_key'])
+            updated_count += len(changed_orders)
+
+        self.stdout.write(f'Обновлено заказов: {updated_count}')
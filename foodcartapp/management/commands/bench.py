@@ -0,0 +1,156 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from foodcartapp.availability import get_menu_snapshot
+from foodcartapp.benchmarks import isolated_environment, measure, reset_process_caches, seed_dataset
+from foodcartapp.models import Order
+
+
+# Время и память шумят от прогона к прогону, поэтому сравниваем с запасом.
+# Число запросов от шума не зависит: любой лишний запрос — регрессия
+NOISY_METRICS = ['p50_ms', 'p90_ms', 'peak_memory_kb']
+
+
+def get_scenarios(manager, seed):
+    rng = random.Random(seed)
+    client = Client()
+    manager_client = Client()
+    manager_client.force_login(manager)
+    product_ids = sorted(get_menu_snapshot().available_products)
+
+    def check(response):
+        if response.status_code >= 400:
+            raise CommandError(f'{response.request["PATH_INFO"]} ответил {response.status_code}')
+
+    def prefetch_items():
+        Order.objects.prefetch_items()
+
+    def product_list_api():
+        check(client.get('/api/products/'))
+
+    def register_order():
+        order = {
+            'products': [
+                {'product': product_id, 'quantity': rng.randint(1, 3)}
+                for product_id in rng.sample(product_ids, k=min(3, len(product_ids)))
+            ],
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79991234567',
+            'address': f'Москва, Клиентская улица, {rng.randint(0, 10000)}',
+        }
+        check(client.post('/api/order/', data=json.dumps(order), content_type='application/json'))
+
+    def view_products():
+        check(manager_client.get(reverse('restaurateur:ProductsView')))
+
+    return {
+        'prefetch_items': prefetch_items,
+        'product_list_api': product_list_api,
+        'register_order': register_order,
+        'view_products': view_products,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Сравнивает замеры с сохранёнными ранее
+    :param threshold: на какую долю метрика может вырасти, прежде чем это считать регрессией
+    :return: (сравнение по сценариям, список регрессий)
+    """
+    comparison = {}
+    regressions = []
+    for name, result in results.items():
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None:
+            continue
+        comparison[name] = {}
+        for metric in [*NOISY_METRICS, 'queries']:
+            old, new = baseline_result[metric], result[metric]
+            change = round(new / old - 1, 3) if old else None
+            comparison[name][metric] = {'baseline': old, 'current': new, 'change': change}
+            allowed = old * (1 + threshold) if metric in NOISY_METRICS else old
+            if new > allowed:
+                regressions.append(f'{name}.{metric}: {old} → {new}')
+    return comparison, regressions
+
+
+class Command(BaseCommand):
+    help = 'Замеряет основные запросы сайта на синтетических данных и печатает результат в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=50, help='Сколько ресторанов создать')
+        parser.add_argument('--products', type=int, default=1000, help='Сколько продуктов создать')
+        parser.add_argument(
+            '--density', type=float, default=0.5,
+            help='Какая доля продуктов есть в меню каждого ресторана, от 0 до 1',
+        )
+        parser.add_argument('--orders', type=int, default=500, help='Сколько необработанных заказов создать')
+        parser.add_argument('--repeat', type=int, default=20, help='Сколько раз замерять каждый сценарий')
+        parser.add_argument('--warmup', type=int, default=2, help='Сколько вызовов сделать до замеров')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора синтетических данных')
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Сбрасывать кэши процесса перед каждым вызовом',
+        )
+        parser.add_argument('--scenario', action='append', help='Замерить только этот сценарий')
+        parser.add_argument('--output', help='Сохранить результат в файл, а не печатать')
+        parser.add_argument('--baseline', help='Сравнить с результатом, сохранённым ранее через --output')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='На какую долю время и память могут вырасти относительно --baseline. По умолчанию 0.2',
+        )
+
+    def handle(self, *args, **options):
+        params = {
+            name: options[name]
+            for name in ['restaurants', 'products', 'density', 'orders', 'repeat', 'warmup', 'seed', 'cold']
+        }
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline['params'] != params:
+                self.stderr.write(f'Параметры отличаются от сохранённых в {options["baseline"]}: {baseline["params"]}')
+
+        results = {}
+        with isolated_environment():
+            self.stderr.write('Создаю синтетические данные…')
+            manager = seed_dataset(
+                options['restaurants'], options['products'], options['density'], options['orders'], options['seed'],
+            )
+            scenarios = get_scenarios(manager, options['seed'])
+            unknown_scenarios = set(options['scenario'] or []) - set(scenarios)
+            if unknown_scenarios:
+                raise CommandError(f'Нет таких сценариев: {", ".join(sorted(unknown_scenarios))}')
+
+            for name, run in scenarios.items():
+                if options['scenario'] and name not in options['scenario']:
+                    continue
+                self.stderr.write(f'Замеряю {name}…')
+                results[name] = measure(
+                    run,
+                    repeat=options['repeat'],
+                    warmup=options['warmup'],
+                    before_each=reset_process_caches if options['cold'] else None,
+                )
+
+        report = {'params': params, 'results': results}
+        regressions = []
+        if baseline is not None:
+            report['comparison'], regressions = compare(results, baseline, options['threshold'])
+
+        content = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+        if regressions:
+            raise CommandError('Стало хуже, чем в базовом замере:\n' + '\n'.join(regressions))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.idempotency import get_expiration_date
+from foodcartapp.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные ключи идемпотентности'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=get_expiration_date()).delete()
+        self.stdout.write(f'Удалено ключей: {deleted}')
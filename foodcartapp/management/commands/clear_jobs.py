@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.jobs import delete_finished_jobs
+
+
+class Command(BaseCommand):
+    help = 'Удаляет давно завершённые фоновые задачи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Сколько дней хранить задачи, по умолчанию JOB_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        deleted = delete_finished_jobs(options['days'])
+        self.stdout.write(f'Удалено задач: {deleted}')
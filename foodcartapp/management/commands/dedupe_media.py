@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Переименовывает картинки товаров по хэшу содержимого и удаляет их копии'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет сделано, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        storage = Product._meta.get_field('image').storage
+        products_by_image = defaultdict(list)
+        for product in Product.objects.exclude(image=''):
+            products_by_image[product.image.name].append(product)
+
+        # Картинки товаров лежат в корне MEDIA_ROOT, уменьшенные копии в подкаталогах не трогаем
+        names_by_content = defaultdict(list)
+        for name in storage.listdir('')[1]:
+            with storage.open(name) as file:
+                names_by_content[storage.get_content_name(name, file)].append(name)
+
+        renamed_products = 0
+        removed_files = 0
+        freed_bytes = 0
+        for content_name, names in names_by_content.items():
+            if not any(name in products_by_image for name in names):
+                # Файл не нужен ни одному товару: неизвестно, чей он, поэтому оставляем как есть
+                continue
+
+            if not storage.exists(content_name) and not options['dry_run']:
+                with storage.open(names[0]) as file:
+                    storage.save(content_name, file)
+
+            with transaction.atomic():
+                for name in names:
+                    for product in products_by_image.get(name, []):
+                        if product.image.name == content_name:
+                            continue
+                        renamed_products += 1
+                        if options['dry_run']:
+                            continue
+                        product.image.name = content_name
+                        if product.image_variants.get('source') == name:
+                            # Содержимое то же, пересобирать уменьшенные копии незачем
+                            product.image_variants['source'] = content_name
+                        product.save(update_fields=['image', 'image_variants'])
+
+            for name in names:
+                if name == content_name:
+                    continue
+                removed_files += 1
+                freed_bytes += storage.size(name)
+                if not options['dry_run']:
+                    storage.delete(name)
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет переименовано картинок у товаров: {renamed_products}')
+            self.stdout.write(f'Будет удалено копий: {removed_files}, освободится {freed_bytes // 1024} КБ')
+        else:
+            self.stdout.write(f'Переименовано картинок у товаров: {renamed_products}')
+            self.stdout.write(f'Удалено копий: {removed_files}, освобождено {freed_bytes // 1024} КБ')
@@ -0,0 +1,25 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.fake_geocoder import start_fake_geocoder
+
+
+class Command(BaseCommand):
+    help = 'Запускает поддельный геокодер Яндекса для нагрузочных прогонов без похода в интернет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='На каком адресе слушать')
+        parser.add_argument('--port', type=int, default=8001, help='На каком порту слушать')
+
+    def handle(self, *args, **options):
+        server = start_fake_geocoder(options['host'], options['port'])
+        self.stderr.write(f'Геокодер слушает {server.url}, передайте его сайту в GEOCODER_URL. Остановить: Ctrl+C')
+        try:
+            # Сервер работает в своём потоке, а этот просто ждёт Ctrl+C
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.geocoder import get_coordinates_many
+from foodcartapp.models import Restaurant
+from foodcartapp.place_distances import forget_restaurant_distances
+from star_burger import settings
+
+
+class Command(BaseCommand):
+    help = 'Заполняет координаты ресторанов по их адресам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересчитать координаты всех ресторанов, а не только тех, где их нет',
+        )
+
+    def handle(self, *args, **options):
+        restaurants = Restaurant.objects.exclude(address='')
+        if not options['all']:
+            restaurants = restaurants.filter(lat__isnull=True) | restaurants.filter(lon__isnull=True)
+        restaurants = list(restaurants)
+
+        coordinates = get_coordinates_many(settings.YANDEX_KEY, [restaurant.address for restaurant in restaurants])
+
+        updated = []
+        not_found = []
+        failed = []
+        for restaurant in restaurants:
+            if restaurant.address not in coordinates:
+                # Геокодер не ответил: старые координаты лучше, чем никаких
+                failed.append(restaurant)
+                continue
+            restaurant_coordinates = coordinates[restaurant.address]
+            if restaurant_coordinates is None:
+                not_found.append(restaurant)
+            restaurant.lat, restaurant.lon = restaurant_coordinates or (None, None)
+            updated.append(restaurant)
+        moved = [restaurant for restaurant in updated if restaurant.has_location_changed()]
+        Restaurant.objects.bulk_update(moved, ['lat', 'lon'])
+        # bulk_update не отправляет post_save, поэтому старые расстояния забываем сами
+        if moved:
+            forget_restaurant_distances([restaurant.id for restaurant in moved])
+
+        self.stdout.write(f'Обновлено ресторанов: {len(updated) - len(not_found)}')
+        for restaurant in not_found:
+            self.stderr.write(f'Не удалось найти адрес ресторана «{restaurant}»: {restaurant.address}')
+        for restaurant in failed:
+            self.stderr.write(f'Геокодер не ответил на адрес ресторана «{restaurant}», координаты не изменены')
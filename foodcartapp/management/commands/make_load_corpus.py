@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodcartapp.load_replay import build_corpus
+
+
+class Command(BaseCommand):
+    help = 'Собирает из товаров в базе корпус запросов к API для replay_load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Куда записать корпус в формате JSON Lines')
+        parser.add_argument('--count', type=int, default=1000, help='Сколько запросов собрать')
+        parser.add_argument('--order-share', type=float, default=0.2, help='Доля оформлений заказа, от 0 до 1')
+        parser.add_argument('--banner-share', type=float, default=0.1, help='Доля запросов баннеров, от 0 до 1')
+        parser.add_argument('--addresses', type=int, default=100, help='Сколько разных адресов у клиентов')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора')
+
+    def handle(self, *args, **options):
+        if options['order_share'] + options['banner_share'] > 1:
+            raise CommandError('Доли заказов и баннеров в сумме больше единицы')
+        try:
+            corpus = build_corpus(
+                options['count'],
+                order_share=options['order_share'],
+                banner_share=options['banner_share'],
+                addresses_count=options['addresses'],
+                seed=options['seed'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        with open(options['output'], 'w') as output_file:
+            for entry in corpus:
+                output_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.stderr.write(f'Записано запросов: {len(corpus)}')
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodcartapp.load_replay import read_corpus, replay, summarize
+
+
+class Command(BaseCommand):
+    help = 'Проигрывает корпус запросов против запущенного сайта и печатает в JSON пропускную способность и задержки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Файл JSON Lines с запросами, например из make_load_corpus')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес сайта')
+        parser.add_argument('--concurrency', type=int, default=10, help='Сколько запросов держать в полёте')
+        parser.add_argument('--requests', type=int, help='Сколько запросов отправить, по умолчанию весь корпус')
+        parser.add_argument(
+            '--rate', type=float,
+            help='Запросов в секунду. Без него каждый поток шлёт запросы друг за другом, как успевает сервер',
+        )
+        parser.add_argument(
+            '--arrival', choices=['poisson', 'constant'], default='poisson',
+            help='Как распределены запросы при --rate: случайно, как от независимых клиентов, или равномерно',
+        )
+        parser.add_argument('--timeout', type=float, default=10, help='Сколько секунд ждать ответа')
+        parser.add_argument('--idempotency', action='store_true', help='Добавлять к заказам новый Idempotency-Key')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора промежутков между запросами')
+        parser.add_argument('--output', help='Сохранить результат в файл, а не печатать')
+        parser.add_argument(
+            '--max-error-rate', type=float,
+            help='Завершиться с ошибкой, если доля неудачных запросов больше этой',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должен быть не меньше 1')
+        if options['rate'] is not None and options['rate'] <= 0:
+            raise CommandError('--rate должен быть больше нуля')
+        try:
+            with open(options['corpus']) as corpus_file:
+                corpus = read_corpus(corpus_file)
+        except ValueError as error:
+            raise CommandError(f'{options["corpus"]}: {error}')
+        if not corpus:
+            raise CommandError(f'{options["corpus"]}: корпус пуст')
+
+        self.stderr.write(f'Отправляю запросы на {options["url"]}…')
+        results, elapsed = replay(
+            corpus,
+            options['url'],
+            options['concurrency'],
+            requests_count=options['requests'],
+            rate=options['rate'],
+            arrival=options['arrival'],
+            timeout=options['timeout'],
+            idempotency=options['idempotency'],
+            seed=options['seed'],
+        )
+        params = {
+            name: options[name]
+            for name in ['url', 'concurrency', 'requests', 'rate', 'arrival', 'idempotency', 'seed']
+        }
+        report = {'params': params, **summarize(results, elapsed)}
+
+        content = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+        total = report['total']
+        if options['max_error_rate'] is not None and total and total['error_rate'] > options['max_error_rate']:
+            raise CommandError(f'Доля ошибок {total["error_rate"]} больше {options["max_error_rate"]}')
@@ -0,0 +1,27 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в базе данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить то, что есть в очереди, и выйти')
+        parser.add_argument('--batch-size', type=int, default=10, help='Сколько задач забирать за раз')
+        parser.add_argument('--sleep', type=float, default=1, help='Пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        while True:
+            claimed = run_pending_jobs(options['batch_size'], worker_id)
+            if claimed:
+                self.stdout.write(f'Выполнено задач: {claimed}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,322 @@
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from star_burger import settings
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get_values(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge_values(values, other_values):
+        for key, value in other_values.items():
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        """
+        :param values: значения, собранные со всех процессов; по умолчанию значения этого процесса
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        values = sorted((self.get_values() if values is None else values).items())
+        for key, value in values:
+            lines.append(f'{self.name}{format_labels(zip(self.labelnames, key))} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма в духе Prometheus: сколько наблюдений попало в каждую корзину, их сумма и число.
+    Живёт в памяти процесса, общую для всех воркеров gunicorn картину собирает render_metrics.
+    """
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = list(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Счётчики по корзинам плюс корзина «больше последней границы», сумма, число
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def get_values(self):
+        with self._lock:
+            return {key: [[*buckets], total, count] for key, (buckets, total, count) in self._values.items()}
+
+    @staticmethod
+    def merge_values(values, other_values):
+        for key, (buckets, total, count) in other_values.items():
+            counts = values.get(key)
+            if counts is None:
+                values[key] = [[*buckets], total, count]
+                continue
+            counts[0] = [bucket_count + other_count for bucket_count, other_count in zip(counts[0], buckets)]
+            counts[1] += total
+            counts[2] += count
+
+    def render(self, values=None):
+        """
+        :param values: значения, собранные со всех процессов; по умолчанию значения этого процесса
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        values = sorted((self.get_values() if values is None else values).items())
+        for key, (buckets, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, '+Inf'], buckets):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels([*labels, ("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+REQUESTS = Counter(
+    'http_requests_total', 'Обработанные запросы', ['view', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Время ответа вьюхи', LATENCY_BUCKETS, ['view', 'method'],
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL-запросов за один HTTP-запрос', COUNT_BUCKETS, ['view'],
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Время в базе данных за один HTTP-запрос', LATENCY_BUCKETS, ['view'],
+)
+REQUEST_GEOCODER_CALLS = Histogram(
+    'http_request_geocoder_calls', 'Запросов к геокодеру за один HTTP-запрос', COUNT_BUCKETS, ['view'],
+)
+GEOCODER_DURATION = Histogram(
+    'geocoder_request_duration_seconds', 'Время запроса к геокодеру', LATENCY_BUCKETS, ['outcome'],
+)
+METRICS = [
+    REQUESTS, REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_DURATION, REQUEST_GEOCODER_CALLS, GEOCODER_DURATION,
+]
+
+
+_process_file = None
+_dumper_pid = None
+_dumper_lock = threading.Lock()
+
+
+def get_process_file():
+    """
+    Файл, куда процесс выкладывает свои метрики. В имени не только pid: после перезапуска воркера
+    pid может достаться новому процессу, и тот затёр бы счётчики старого.
+    """
+    global _process_file
+    pid = os.getpid()
+    if _process_file is None or _process_file[0] != pid:
+        _process_file = (pid, Path(settings.METRICS_DIR) / f'metrics-{pid}-{uuid.uuid4().hex}.json')
+    return _process_file[1]
+
+
+def dump_metrics():
+    """
+    Выкладывает метрики процесса в METRICS_DIR, чтобы /metrics в любом воркере показал их вместе с остальными
+    """
+    if not settings.METRICS_DIR:
+        return
+    content = json.dumps({
+        metric.name: [[key, value] for key, value in metric.get_values().items()]
+        for metric in METRICS
+    })
+    path = get_process_file()
+    temporary_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+    temporary_path.write_text(content)
+    # Файл подменяется целиком, поэтому читатель не увидит его наполовину записанным
+    os.replace(temporary_path, path)
+
+
+def dump_metrics_periodically():
+    while True:
+        time.sleep(settings.METRICS_DUMP_INTERVAL)
+        try:
+            dump_metrics()
+        except OSError:
+            logger.exception('Не удалось выложить метрики в %s', settings.METRICS_DIR)
+
+
+def start_dumping():
+    """
+    Запускает в процессе поток, который раз в METRICS_DUMP_INTERVAL выкладывает метрики,
+    а при выходе процесса выкладывает их последний раз. Запросы сами файлы не пишут.
+    """
+    global _dumper_pid
+    pid = os.getpid()
+    if not settings.METRICS_DIR or _dumper_pid == pid:
+        return
+    with _dumper_lock:
+        if _dumper_pid == pid:
+            return
+        # После fork поток родителя в дочернем процессе не работает, поэтому проверяем pid, а не флаг
+        if _dumper_pid is None:
+            atexit.register(dump_metrics)
+        _dumper_pid = pid
+        threading.Thread(target=dump_metrics_periodically, name='metrics-dump', daemon=True).start()
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, просто чужой
+        return True
+    return True
+
+
+def collect_metrics():
+    """
+    Файлы завершившихся процессов удаляются: их счётчики пропадают из суммы, как при перезапуске,
+    а Prometheus умеет считать такие сбросы.
+    :return: {метрика: значения}, сложенные по всем процессам, которые выкладывают метрики в METRICS_DIR
+    """
+    if not settings.METRICS_DIR:
+        return {metric: metric.get_values() for metric in METRICS}
+    dump_metrics()
+    metrics_by_name = {metric.name: metric for metric in METRICS}
+    collected = {metric: {} for metric in METRICS}
+    for path in Path(settings.METRICS_DIR).glob('metrics-*.json'):
+        pid = int(path.name.split('-')[1])
+        if not is_process_alive(pid):
+            path.unlink(missing_ok=True)
+            continue
+        try:
+            dumped = json.loads(path.read_text())
+        except FileNotFoundError:
+            continue
+        for name, values in dumped.items():
+            metric = metrics_by_name.get(name)
+            if metric is not None:
+                metric.merge_values(collected[metric], {tuple(key): value for key, value in values})
+    return collected
+
+
+def render_metrics():
+    """
+    :return: метрики в текстовом формате Prometheus, со всех процессов, если задан METRICS_DIR
+    """
+    lines = []
+    for metric, values in collect_metrics().items():
+        lines.extend(metric.render(values))
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """
+    Что насчитал один HTTP-запрос: SQL-запросы и обращения к геокодеру
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0
+        self.geocoder_calls = 0
+        self.geocoder_seconds = 0
+        # Геокодер опрашивается из пула потоков, поэтому счётчики меняем под блокировкой
+        self._lock = threading.Lock()
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Подключается через connection.execute_wrapper и засекает каждый SQL-запрос
+        """
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started_at
+            with self._lock:
+                self.queries += 1
+                self.query_seconds += duration
+
+    def record_geocoder_call(self, duration):
+        with self._lock:
+            self.geocoder_calls += 1
+            self.geocoder_seconds += duration
+
+
+_local = threading.local()
+
+
+def get_request_stats():
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def collect_request_stats(stats=None):
+    """
+    Привязывает к текущему потоку счётчики запроса, в который будут писать record_geocoder_call и SQL-обёртка
+    :param stats: уже созданные счётчики, например из потока, который породил этот
+    """
+    previous_stats = get_request_stats()
+    _local.stats = stats or RequestStats()
+    try:
+        yield _local.stats
+    finally:
+        _local.stats = previous_stats
+
+
+def record_geocoder_call(duration, outcome):
+    GEOCODER_DURATION.observe(duration, outcome=outcome)
+    stats = get_request_stats()
+    if stats is not None:
+        stats.record_geocoder_call(duration)
+    start_dumping()
+
+
+def record_request(view, method, status, duration, stats):
+    REQUESTS.inc(view=view, method=method, status=status)
+    REQUEST_DURATION.observe(duration, view=view, method=method)
+    REQUEST_QUERIES.observe(stats.queries, view=view)
+    REQUEST_DB_DURATION.observe(stats.query_seconds, view=view)
+    REQUEST_GEOCODER_CALLS.observe(stats.geocoder_calls, view=view)
+    start_dumping()
@@ -1,17 +1,14 @@
 
-import re
-
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Count
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+from django.db.models import Count, Sum
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
-from geopy import distance
-from requests import HTTPError
 
-from foodcartapp.get_geo import fetch_coordinates
-from star_burger import settings
+from foodcartapp.availability import get_menu_snapshot
+from foodcartapp.geocoder import get_coordinates
+from foodcartapp.order_search import get_name_key, normalize_phone
+from foodcartapp.storage import product_images_storage
 
 
 class Restaurant(models.Model):
@@ -29,6 +26,16 @@ class Restaurant(models.Model):
         max_length=50,
         blank=True,
     )
+    lat = models.FloatField(
+        'широта',
+        null=True,
+        blank=True,
+    )
+    lon = models.FloatField(
+        'долгота',
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = 'ресторан'
@@ -37,15 +44,55 @@ class Restaurant(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        restaurant = super().from_db(db, field_names, values)
+        restaurant._loaded_location = restaurant._get_location()
+        return restaurant
+
+    def _get_location(self):
+        # Отложенные через only() поля не читаем, чтобы не делать лишних запросов
+        return tuple(self.__dict__.get(field) for field in ['address', 'lat', 'lon'])
+
+    def has_location_changed(self):
+        """
+        Поменялись ли адрес или координаты с тех пор, как ресторан прочитали из базы.
+        Новый ресторан считается переехавшим.
+        """
+        return getattr(self, '_loaded_location', None) != self._get_location()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_location = self._get_location()
+
+    @property
+    def coordinates(self):
+        if self.lat is None or self.lon is None:
+            return None
+        return self.lat, self.lon
+
+    def geocode(self, apikey):
+        """
+        Заполняет координаты ресторана по его адресу
+        :param apikey: ключ для yandex api
+        """
+        coordinates = get_coordinates(apikey, self.address) if self.address else None
+        self.lat, self.lon = coordinates if coordinates else (None, None)
+
 
 class ProductQuerySet(models.QuerySet):
-    def available(self):
-        products = (
-            RestaurantMenuItem.objects
-            .filter(availability=True)
-            .values_list('product')
-        )
-        return self.filter(pk__in=products)
+    def available_in_bulk(self, product_ids=None):
+        """
+        Продукты, которые сейчас в продаже. Что в продаже, знает снимок меню в памяти процесса,
+        поэтому с ним пересекаем в Python, а в SQL уходят только запрошенные id, а не всё меню.
+        :param product_ids: какие продукты нужны, по умолчанию все, что в продаже
+        :return: словарь {id: продукт}
+        """
+        available_products = get_menu_snapshot().available_products
+        if product_ids is not None:
+            available_products = [product_id for product_id in product_ids if product_id in available_products]
+        # in_bulk сам режет длинный список id на пачки, если база ограничивает число параметров
+        return self.in_bulk(available_products)
 
 
 class ProductCategory(models.Model):
@@ -82,7 +129,15 @@ class Product(models.Model):
         validators=[MinValueValidator(0)]
     )
     image = models.ImageField(
-        'картинка'
+        'картинка',
+        storage=product_images_storage,
+    )
+    # Уменьшенные копии картинки, см. foodcartapp.image_variants
+    image_variants = models.JSONField(
+        'варианты картинки',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     special_status = models.BooleanField(
         'спец.предложение',
@@ -137,89 +192,73 @@ class RestaurantMenuItem(models.Model):
 
 class Place(models.Model):
     name = models.CharField('Hазвание', max_length=350, db_index=True, unique=True)
-    lon = models.FloatField('Широта')
-    lat = models.FloatField('Долгота')
+    lon = models.FloatField('Долгота', null=True, blank=True)
+    lat = models.FloatField('Широта', null=True, blank=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = 'Место'
         verbose_name_plural = 'Места'
 
+    def __str__(self):
+        return self.name
 
-def get_distance(apikey, place_from, place_to):
-    """
-    Возвращает расстояние между двумя точками в км
-    :param apikey: ключ для yandex api
-    :param place_from: начальная точка
-    :param place_to: конечная точка
-    :return: расстояние в км
-    """
-    try:
-        coords_from = fetch_coordinates(apikey, place_from)
-        coords_to = fetch_coordinates(apikey, place_to)
-        dist = distance.distance(coords_from, coords_to).km
-        return dist
-    except HTTPError as e:
-        return 0
-
-
-def atoi(text):
-    return int(text) if text.isdigit() else text
+    @property
+    def coordinates(self):
+        if self.lat is None or self.lon is None:
+            return None
+        return self.lat, self.lon
 
 
-def natural_keys(text):
-    """
-    alist.sort(key=natural_keys) sorts in human order
-    http://nedbatchelder.com/blog/200712/human_sorting.html
-    (See Toothy's implementation in the comments)
-    """
-    return [atoi(c) for c in re.split(r'[+-]?([0-9]+(?:[.][0-9]*)?|[.][0-9]+)', text)]
+class PlaceDistance(models.Model):
+    place = models.ForeignKey(Place, related_name='distances', verbose_name='Место', on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, related_name='place_distances', verbose_name='Ресторан',
+                                   on_delete=models.CASCADE)
+    distance = models.FloatField('Расстояние, км')
 
+    class Meta:
+        verbose_name = 'Расстояние до ресторана'
+        verbose_name_plural = 'Расстояния до ресторанов'
+        unique_together = ('place', 'restaurant')
 
-def get_place_coordinates(api_key, place):
-    try:
-        place = get_object_or_404(Place, name=place)
-        lon, lat = place.lon, place.lat
-        return lon, lat
-    except Http404:
-        lon, lat = fetch_coordinates(api_key, place)
-        Place.objects.create(name=place, lon=lon, lat=lat)
-        return lon, lat
+    def __str__(self):
+        return f'{self.place} - {self.restaurant}'
 
 
 class OrderQuerySet(models.QuerySet):
-    def prefetch_items(self):
-        apikey = settings.YANDEX_KEY
-        orders = Order.objects.exclude(status=Order.READY).order_by('-status').select_related(
-            'restaurant').prefetch_related('items', 'items__product').annotate(product_count=Count('items__product'))
-
-        menu_items = RestaurantMenuItem.objects.filter(availability=True).values('restaurant', 'product')
-        restaurants = Restaurant.objects.in_bulk([item['restaurant'] for item in menu_items])
-
-        for order in orders:
-            if order.restaurant is None:
-                order_restaurants = []
-                order_products = order.items.all()
-                for restaurant in restaurants:
-                    restaurants_possible = True
-                    for order_product in order_products:
-                        restaurants_for_product = menu_items.filter(product=order_product.product,
-                                                                    restaurant=restaurants[restaurant])
-                        if not restaurants_for_product:
-                            restaurants_possible = False
-                    if restaurants_possible:
-                        div_distance = get_distance(apikey, order.address, restaurants[restaurant].address)
-                        order_restaurants.append({
-                            'restaurant': restaurants[restaurant],
-                            'distance': div_distance
-                        })
-                delivery_restaurants = []
-                if order_restaurants:
-                    for restaurant in order_restaurants:
-                        div_distance = restaurant['distance']
-                        restaurant["restaurant"].distance = div_distance
-                        delivery_restaurants.append(f'{restaurant["restaurant"].name} - {round(div_distance, 0)}')
-                delivery_restaurants.sort(key=natural_keys)
-                order.restaurant_possible = delivery_restaurants
+    def with_total_coast(self):
+        return self.annotate(total_coast=Sum('items__price'))
+
+    def active(self):
+        return self.exclude(status=Order.READY)
+
+    def prefetch_items(self, limit=None):
+        from foodcartapp.candidates import refresh_order_candidates, select_nearest
+
+        orders = self.active().order_by(*Order.DASHBOARD_ORDERING).select_related(
+            'restaurant').prefetch_related('items__product', 'candidates').annotate(
+            product_count=Count('items__product'))
+        if limit is not None:
+            orders = orders[:limit]
+
+        # Рестораны для заказов посчитаны заранее, пересчитываются только устаревшие заказы
+        orders = list(orders)
+        open_orders = [order for order in orders if order.restaurant is None]
+        orders_candidates = refresh_order_candidates(open_orders)
+        restaurants = Restaurant.objects.in_bulk(
+            {candidate.restaurant_id for candidates in orders_candidates.values() for candidate in candidates}
+        )
+
+        for order in open_orders:
+            candidates = sorted(
+                orders_candidates[order.id],
+                key=lambda candidate: restaurants[candidate.restaurant_id].name,
+            )
+            delivery_restaurants = []
+            for candidate in select_nearest(candidates):
+                div_distance = round(candidate.distance, 0) if candidate.distance is not None else '?'
+                delivery_restaurants.append(f'{restaurants[candidate.restaurant_id].name} - {div_distance}')
+            order.restaurant_possible = delivery_restaurants
         return orders
 
 
@@ -240,30 +279,61 @@ class Order(models.Model):
         (CASH, 'Наличный'),
         (CASHLESS, 'Безналичный')
     ]
+    # Порядок заказов в панели менеджера, по нему же работает постраничная навигация
+    DASHBOARD_ORDERING = ['-status', '-registration_date', '-id']
     status = models.CharField('Статус заказа', choices=ORDER_STATUS, default=NEW, max_length=20, db_index=True)
     payment = models.CharField('Способ оплаты', choices=PAYMENT_METHOD, default=CASHLESS, max_length=20, db_index=True)
     firstname = models.CharField('Имя', max_length=50)
     lastname = models.CharField('Фамилия', max_length=50, db_index=True)
     phonenumber = PhoneNumberField(verbose_name='Телефон', db_index=True, region='RU')
+    # Ключи для поиска в админке, см. foodcartapp.order_search. Заполняются в save(), старые заказы —
+    # командой backfill_order_search_keys
+    phone_key = models.CharField('Телефон в E.164', max_length=20, blank=True, db_index=True, editable=False)
+    name_key = models.CharField('Фамилия и имя для поиска', max_length=101, blank=True, db_index=True, editable=False)
     address = models.CharField('Адрес доставки', max_length=120)
     totalprice = models.DecimalField('Сумма заказа', max_digits=10, decimal_places=2,
                                      validators=[MinValueValidator(limit_value=0)])
     comment = models.TextField('Комментарии', max_length=128, blank=True)
-    registration_date = models.DateTimeField('Дата регистрации', blank=True, db_index=True, auto_now=True)
+    registration_date = models.DateTimeField('Дата регистрации', blank=True, db_index=True, auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
     call_date = models.DateTimeField('Дата звонка', blank=True, db_index=True, null=True)
     delivery_date = models.DateTimeField('Дата доставки', blank=True, null=True, db_index=True)
     restaurant = models.ForeignKey(Restaurant, verbose_name='Ресторан', blank=True, null=True, on_delete=models.CASCADE)
+    candidates_version = models.BigIntegerField('Версия меню для расчёта ресторанов', blank=True, null=True)
     objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['-status', '-registration_date', '-id'], name='order_dashboard_idx'),
+            models.Index(fields=['payment', '-status', '-registration_date', '-id'],
+                         name='order_dashboard_payment_idx'),
+            models.Index(fields=['restaurant', '-status', '-registration_date', '-id'],
+                         name='order_dashboard_restaurant_idx'),
+            # По нему менеджерам транслируются изменения заказов, см. restaurateur.views.stream_orders
+            models.Index(fields=['updated_at', 'id'], name='order_updated_idx'),
+        ]
 
     def __str__(self):
         return f'{self.firstname} {self.lastname} {self.phonenumber}'
 
+    def update_search_keys(self):
+        self.phone_key = normalize_phone(self.phonenumber)
+        self.name_key = get_name_key(self.firstname, self.lastname)
+
+    def save(self, *args, **kwargs):
+        self.update_search_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'phonenumber', 'firstname', 'lastname'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'phone_key', 'name_key'}
+        super().save(*args, **kwargs)
+
     def get_total_coast(self):
-        return sum(item.get_coast() for item in self.items.all())
+        # Сумма посчитана в запросе через OrderQuerySet.with_total_coast()
+        if hasattr(self, 'total_coast'):
+            return self.total_coast or 0
+        return sum(item.price for item in self.items.all())
 
     @staticmethod
     def prefetch_products():
@@ -287,3 +357,69 @@ class OrderItem(models.Model):
 
     def get_coast(self):
         return self.product.price * self.quantity
+
+
+class OrderCandidate(models.Model):
+    order = models.ForeignKey(Order, related_name='candidates', verbose_name='Заказ', on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, related_name='order_candidates', verbose_name='Ресторан',
+                                   on_delete=models.CASCADE)
+    distance = models.FloatField('Расстояние, км', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Ресторан для заказа'
+        verbose_name_plural = 'Рестораны для заказов'
+        unique_together = ('order', 'restaurant')
+
+    def __str__(self):
+        return f'{self.order_id} - {self.restaurant_id}'
+
+
+class IdempotencyKey(models.Model):
+    key = models.CharField('Ключ', max_length=255, unique=True)
+    request_hash = models.CharField(
+        'Хеш запроса',
+        max_length=64,
+        help_text='SHA-256 тела запроса, чтобы не отдать сохранённый ответ на другой заказ с тем же ключом',
+    )
+    response = models.JSONField('Ответ')
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+
+    def __str__(self):
+        return self.key
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    JOB_STATUS = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Не удалась'),
+    ]
+    name = models.CharField('Задача', max_length=100, db_index=True)
+    payload = models.JSONField('Параметры', default=dict, blank=True)
+    status = models.CharField('Статус', choices=JOB_STATUS, default=PENDING, max_length=20)
+    attempts = models.PositiveIntegerField('Попыток', default=0)
+    run_after = models.DateTimeField('Запустить после', default=timezone.now)
+    locked_at = models.DateTimeField('Взята в работу', blank=True, null=True)
+    locked_by = models.CharField('Воркер', max_length=100, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    finished_at = models.DateTimeField('Завершена', blank=True, null=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
@@ -0,0 +1,91 @@
+import re
+
+import phonenumbers
+from django.db.models import Q
+
+from foodcartapp.search_index import tokenize
+
+
+PHONE_REGION = 'RU'
+PHONE_QUERY_PATTERN = re.compile(r'^\+?[\d\s()-]+$')
+# Короче этого по номеру искать бессмысленно: совпадёт полбазы
+MIN_PHONE_PREFIX_DIGITS = 4
+# Коды мобильных операторов в России начинаются с 9
+MOBILE_CODE_FIRST_DIGITS = '9'
+
+
+def normalize_phone(phonenumber):
+    """
+    Приводит телефон к виду E.164, например +79991234567
+    :param phonenumber: строка или PhoneNumber, в любом формате, в котором его ввёл клиент
+    :return: номер в E.164 или пустая строка, если это не похоже на номер
+    """
+    try:
+        number = phonenumbers.parse(str(phonenumber or ''), PHONE_REGION)
+    except phonenumbers.NumberParseException:
+        return ''
+    if not phonenumbers.is_possible_number(number):
+        return ''
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def get_name_key(firstname, lastname):
+    """
+    Ключ для поиска по клиенту: фамилия и имя без учёта регистра, «ё» приравнена к «е»
+    """
+    return ' '.join(tokenize(f'{lastname} {firstname}'))
+
+
+def get_phone_prefix(query):
+    """
+    Начало номера в E.164 по тому, что набрал оператор: «8 (999) 12», «+7999 12», «99912»
+    :return: начало номера или None, если запрос не похож на номер
+    """
+    if not PHONE_QUERY_PATTERN.match(query):
+        return None
+    digits = re.sub(r'\D', '', query)
+    if len(digits) < MIN_PHONE_PREFIX_DIGITS:
+        return None
+    if query.lstrip().startswith('+'):
+        return f'+{digits}'
+    # Без плюса номер набирают по-российски: через 8, через 7 или сразу с кода мобильного оператора.
+    # Остальные цифры вроде «4567» скорее часть номера заказа или имени, а не начало телефона
+    if digits[0] in '78':
+        return f'+7{digits[1:]}'
+    if digits[0] in MOBILE_CODE_FIRST_DIGITS:
+        return f'+7{digits}'
+    return None
+
+
+def get_orders_lookup(query):
+    """
+    Условие для поиска заказов по телефону или клиенту. Оба ключа проиндексированы,
+    а поиск идёт по точному совпадению или началу ключа, поэтому история заказов не сканируется целиком.
+    :param query: строка поиска из админки
+    :return: Q или None, если искать нечего
+    """
+    query = query.strip()
+    if not query:
+        return None
+
+    phone_prefix = get_phone_prefix(query)
+    if phone_prefix is not None:
+        # Номер набран целиком, если разбор по правилам телефонии дал то же самое, что и разбор начала номера
+        if normalize_phone(query) == phone_prefix:
+            return Q(phone_key=phone_prefix)
+        return Q(phone_key__startswith=phone_prefix)
+
+    # Городской номер целиком, но без 8 и +7, например 4951234567, по началу не ищем, зато ищем точно
+    if PHONE_QUERY_PATTERN.match(query):
+        phone = normalize_phone(query)
+        if phone:
+            return Q(phone_key=phone)
+
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    # Ключ начинается с фамилии, но имя и фамилию часто набирают в обратном порядке
+    lookup = Q(name_key__startswith=' '.join(tokens))
+    if len(tokens) == 2:
+        lookup |= Q(name_key__startswith=' '.join(reversed(tokens)))
+    return lookup
@@ -0,0 +1,69 @@
+from django.db import transaction
+
+from foodcartapp.geocoder import get_coordinates_many, normalize_address
+from foodcartapp.models import Order, Place, PlaceDistance
+from foodcartapp.spatial_index import get_restaurant_index, invalidate_restaurant_index
+from star_burger import settings
+
+
+def get_restaurant_distances(restaurants_by_address):
+    """
+    Возвращает расстояния от адресов до ресторанов. Уже посчитанные пары берутся
+    из таблицы PlaceDistance, новые считаются пачкой и сохраняются туда же.
+    :param restaurants_by_address: словарь {адрес: множество id ресторанов}
+    :return: словарь {адрес: {restaurant_id: км или None, если геокодер не нашёл адрес}};
+        адресов, на которых геокодер не ответил, в словаре нет
+    """
+    coordinates = get_coordinates_many(settings.YANDEX_KEY, restaurants_by_address.keys())
+    place_names = {address: normalize_address(address) for address in restaurants_by_address}
+    place_ids = dict(Place.objects.filter(name__in=place_names.values()).values_list('name', 'id'))
+
+    restaurant_ids = set().union(*restaurants_by_address.values())
+    stored_distances = {
+        (place_id, restaurant_id): distance
+        for place_id, restaurant_id, distance in PlaceDistance.objects.filter(
+            place_id__in=place_ids.values(),
+            restaurant_id__in=restaurant_ids,
+        ).values_list('place_id', 'restaurant_id', 'distance')
+    }
+
+    restaurant_index = get_restaurant_index()
+    address_distances = {}
+    new_distances = []
+    for address, address_restaurant_ids in restaurants_by_address.items():
+        place_id = place_ids.get(place_names[address])
+        distances = {
+            restaurant_id: stored_distances[(place_id, restaurant_id)]
+            for restaurant_id in address_restaurant_ids
+            if (place_id, restaurant_id) in stored_distances
+        }
+        missing_ids = address_restaurant_ids - distances.keys()
+        if missing_ids and address not in coordinates:
+            # Геокодер не ответил: расстояния неизвестны пока, а не навсегда
+            continue
+        address_point = coordinates.get(address)
+        if missing_ids and address_point is not None:
+            for restaurant_id, distance in restaurant_index.nearest(address_point, allowed=missing_ids):
+                distances[restaurant_id] = distance
+                if place_id is not None:
+                    new_distances.append(
+                        PlaceDistance(place_id=place_id, restaurant_id=restaurant_id, distance=distance)
+                    )
+        address_distances[address] = {
+            restaurant_id: distances.get(restaurant_id) for restaurant_id in address_restaurant_ids
+        }
+
+    PlaceDistance.objects.bulk_create(new_distances, ignore_conflicts=True)
+    return address_distances
+
+
+def forget_restaurant_distances(restaurant_ids):
+    """
+    Забывает всё, что посчитано по старым координатам ресторанов: расстояния до них, ресторанный индекс
+    и рестораны-кандидаты для ещё не назначенных заказов. Вызывайте после любого изменения адреса или координат,
+    в том числе после bulk_update, который не отправляет сигналы.
+    :param restaurant_ids: id ресторанов, которые переехали или появились
+    """
+    PlaceDistance.objects.filter(restaurant_id__in=restaurant_ids).delete()
+    Order.objects.exclude(status=Order.READY).filter(restaurant__isnull=True).update(candidates_version=None)
+    transaction.on_commit(invalidate_restaurant_index)
@@ -0,0 +1,228 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+
+from foodcartapp.cache_versions import VersionedCopy, bump_version, get_version
+
+
+SEARCH_VERSION_KEY = 'foodcartapp:search_version'
+
+# Совпадение в названии важнее совпадения в категории, а то — важнее описания
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+PREFIX_MATCH_FACTOR = 0.7
+FUZZY_MATCH_FACTOR = 0.5
+MIN_TRIGRAM_SIMILARITY = 0.3
+# Короткие слова дают слишком мало триграмм, их ищем только по началу
+MIN_FUZZY_TOKEN_LENGTH = 3
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Разбивает текст на слова без учёта регистра. casefold, в отличие от SQLite, понимает кириллицу,
+    а «ё» приравнивается к «е», как её обычно и набирают.
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold().replace('ё', 'е')
+    return TOKEN_PATTERN.findall(text)
+
+
+def get_trigrams(token):
+    # Пробелы по краям, как в pg_trgm, чтобы начало и конец слова весили больше
+    padded = f'  {token} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    """
+    Обратный индекс по названию, описанию и категории товаров: слово → товары, в которых оно встречается.
+    Словарь слов отсортирован, чтобы искать по началу слова, а триграммы слов прощают опечатки.
+    """
+
+    def __init__(self, version, products=()):
+        """
+        :param version: версия поиска, из которой собран индекс
+        :param products: пятёрки (product_id, название, описание, название категории, id категории)
+        """
+        self.version = version
+        self.built_at = time.monotonic()
+        self.postings = defaultdict(dict)
+        self.terms = []
+        self.terms_by_trigram = defaultdict(set)
+        self.products = {}
+        self._lock = threading.RLock()
+        for product in products:
+            self.add(*product)
+
+    def __len__(self):
+        return len(self.products)
+
+    def add(self, product_id, name, description, category_name, category_id):
+        with self._lock:
+            self.remove(product_id)
+            weights = {}
+            for field, text in [('name', name), ('category', category_name), ('description', description)]:
+                for term in tokenize(text):
+                    weights[term] = max(weights.get(term, 0), FIELD_WEIGHTS[field])
+            for term, weight in weights.items():
+                if term not in self.postings:
+                    bisect.insort(self.terms, term)
+                    for trigram in get_trigrams(term):
+                        self.terms_by_trigram[trigram].add(term)
+                self.postings[term][product_id] = weight
+            self.products[product_id] = (category_id, set(weights))
+
+    def remove(self, product_id):
+        with self._lock:
+            if product_id not in self.products:
+                return
+            _, terms = self.products.pop(product_id)
+            for term in terms:
+                postings = self.postings[term]
+                postings.pop(product_id, None)
+                if postings:
+                    continue
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+                for trigram in get_trigrams(term):
+                    self.terms_by_trigram[trigram].discard(term)
+                    if not self.terms_by_trigram[trigram]:
+                        del self.terms_by_trigram[trigram]
+
+    def get_category_products(self, category_id):
+        with self._lock:
+            return [
+                product_id for product_id, (product_category_id, _) in self.products.items()
+                if product_category_id == category_id
+            ]
+
+    def _match_term(self, token):
+        """
+        :return: словарь {слово из индекса: множитель}, какие слова засчитать за слово запроса
+        """
+        matches = {}
+        if len(token) >= MIN_FUZZY_TOKEN_LENGTH:
+            trigrams = get_trigrams(token)
+            shared = defaultdict(int)
+            for trigram in trigrams:
+                for term in self.terms_by_trigram.get(trigram, ()):
+                    shared[term] += 1
+            for term, shared_count in shared.items():
+                similarity = shared_count / (len(trigrams) + len(get_trigrams(term)) - shared_count)
+                if similarity >= MIN_TRIGRAM_SIMILARITY:
+                    matches[term] = FUZZY_MATCH_FACTOR * similarity
+
+        for index in range(bisect.bisect_left(self.terms, token), len(self.terms)):
+            term = self.terms[index]
+            if not term.startswith(token):
+                break
+            matches[term] = PREFIX_MATCH_FACTOR
+        if token in self.postings:
+            matches[token] = 1
+        return matches
+
+    def search(self, query, allowed=None):
+        """
+        Ищет товары, в которых нашлось каждое слово запроса: целиком, по началу или с опечаткой
+        :param query: строка поиска
+        :param allowed: id товаров, среди которых искать; None — все
+        :return: список (product_id, релевантность), сначала самые подходящие
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        scores = None
+        with self._lock:
+            for token in tokens:
+                token_scores = {}
+                for term, factor in self._match_term(token).items():
+                    for product_id, weight in self.postings[term].items():
+                        if allowed is not None and product_id not in allowed:
+                            continue
+                        token_scores[product_id] = max(token_scores.get(product_id, 0), weight * factor)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        product_id: score + token_scores[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in token_scores
+                    }
+                if not scores:
+                    return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def get_search_version():
+    return get_version(SEARCH_VERSION_KEY)
+
+
+def bump_search_version():
+    """
+    Сообщает всем процессам, что товары изменились. Вызывайте после массовых
+    операций вроде queryset.update(), которые не отправляют сигналы моделей.
+    """
+    return bump_version(SEARCH_VERSION_KEY)
+
+
+def get_products_for_index(**filters):
+    from foodcartapp.models import Product
+
+    return list(
+        Product.objects.filter(**filters).values_list('id', 'name', 'description', 'category__name', 'category_id')
+    )
+
+
+_index = VersionedCopy(
+    SEARCH_VERSION_KEY, lambda version: ProductSearchIndex(version, get_products_for_index()), 'SEARCH_INDEX_MAX_AGE',
+)
+
+
+def get_product_index():
+    """
+    Возвращает поисковый индекс товаров. База читается только если другой процесс поменял товары
+    или индекс устарел.
+    """
+    return _index.get()
+
+
+def reset_product_index():
+    _index.reset()
+
+
+def _apply_change(change):
+    def change_in_place(index, version):
+        change(index)
+        index.version = version
+        return index
+
+    _index.apply_change(change_in_place)
+
+
+def reindex_products(index, product_ids):
+    found_products = get_products_for_index(pk__in=product_ids)
+    for product in found_products:
+        index.add(*product)
+    for product_id in set(product_ids) - {product[0] for product in found_products}:
+        index.remove(product_id)
+
+
+def on_product_saved(product_id):
+    transaction.on_commit(lambda: _apply_change(lambda index: reindex_products(index, [product_id])))
+
+
+def on_product_deleted(product_id):
+    transaction.on_commit(lambda: _apply_change(lambda index: index.remove(product_id)))
+
+
+def on_category_changed(category_id):
+    # При удалении категории база уже обнулила её у товаров, поэтому товары берём из индекса
+    transaction.on_commit(lambda: _apply_change(
+        lambda index: reindex_products(index, index.get_category_products(category_id))
+    ))
@@ -1,9 +1,13 @@
-from django.db import transaction
-from foodcartapp.models import Order, OrderItem
+from django.db import connection, transaction
+from foodcartapp.jobs import enqueue, enqueue_many
+from foodcartapp.models import Order, OrderItem, Product
 from rest_framework import serializers
 
 
 class OrderProductSerializer(serializers.ModelSerializer):
+    # Продукты всего заказа достаём одним запросом в OrderSerializer.validate_products
+    product = serializers.IntegerField(min_value=1)
+
     class Meta:
         model = OrderItem
         fields = ['product', 'quantity']
@@ -16,24 +20,108 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['products', 'phonenumber', 'firstname', 'lastname', 'address']
 
+    def validate_products(self, products):
+        # При пакетной загрузке продукты всех заказов уже достали заранее, см. get_available_products
+        available_products = self.context.get('available_products')
+        if available_products is None:
+            product_ids = {fields['product'] for fields in products}
+            available_products = Product.objects.available_in_bulk(product_ids)
+
+        errors = []
+        seen_product_ids = set()
+        for fields in products:
+            if fields['product'] not in available_products:
+                errors.append({'product': [f'Продукт с id {fields["product"]} не найден или сейчас не продаётся.']})
+            elif fields['product'] in seen_product_ids:
+                # Позиция заказа по продукту одна, повтор уронил бы сохранение на уникальности (order, product)
+                errors.append({'product': [f'Продукт с id {fields["product"]} уже есть в заказе.']})
+            else:
+                errors.append({})
+            seen_product_ids.add(fields['product'])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return [
+            {**fields, 'product': available_products[fields['product']]}
+            for fields in products
+        ]
+
     @transaction.atomic
     def create(self, validated_data):
-        order = Order.objects.create(
-            phonenumber=validated_data['phonenumber'],
-            firstname=validated_data['firstname'],
-            lastname=validated_data['lastname'],
-            address=validated_data['address'],
-            status=Order.NEW,
-            totalprice=0
-        )
-        products = validated_data['products']
-
-        items = [OrderItem(
-            order=order,
-            price=fields['product'].price * fields['quantity'], **fields) for fields in products]
-        OrderItem.objects.bulk_create(items)
-
-        order.totalprice = order.get_total_coast()
+        order, items = build_order(validated_data)
         order.save()
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        # Всё медленное, вроде геокодирования адреса, делает воркер run_jobs
+        enqueue('geocode_order', order_id=order.id)
         return order
 
+
+def build_order(validated_data):
+    """
+    Собирает заказ и его позиции, не сохраняя их в базу
+    :param validated_data: данные, прошедшие проверку OrderSerializer
+    :return: (заказ, список позиций)
+    """
+    # Цены берём из уже провалидированных продуктов, чтобы записать заказ сразу с итоговой суммой
+    items = [
+        OrderItem(price=fields['product'].price * fields['quantity'], **fields)
+        for fields in validated_data['products']
+    ]
+    order = Order(
+        phonenumber=validated_data['phonenumber'],
+        firstname=validated_data['firstname'],
+        lastname=validated_data['lastname'],
+        address=validated_data['address'],
+        status=Order.NEW,
+        totalprice=sum(item.price for item in items)
+    )
+    # bulk_create не вызывает save(), поэтому ключи для поиска заполняем сразу
+    order.update_search_keys()
+    return order, items
+
+
+def get_available_products(payloads):
+    """
+    Одним запросом достаёт продукты, упомянутые в пачке ещё не проверенных заказов
+    :param payloads: сырые данные заказов
+    :return: словарь {product_id: Product}
+    """
+    product_ids = set()
+    for payload in payloads:
+        products = payload.get('products') if isinstance(payload, dict) else None
+        if not isinstance(products, list):
+            continue
+        for fields in products:
+            try:
+                product_ids.add(int(fields['product']))
+            except (TypeError, KeyError, ValueError):
+                continue
+    return Product.objects.available_in_bulk(product_ids)
+
+
+def create_orders(validated_orders):
+    """
+    Сохраняет пачку проверенных заказов в одной транзакции
+    :param validated_orders: список validated_data от OrderSerializer
+    :return: сохранённые заказы в том же порядке
+    """
+    built_orders = [build_order(validated_data) for validated_data in validated_orders]
+    orders = [order for order, _ in built_orders]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Order.objects.bulk_create(orders)
+        else:
+            # SQLite в этой версии Django не возвращает id после bulk_create
+            for order in orders:
+                order.save()
+
+        items = []
+        for order, order_items in built_orders:
+            for item in order_items:
+                item.order = order
+            items.extend(order_items)
+        OrderItem.objects.bulk_create(items)
+        enqueue_many('geocode_order', [{'order_id': order.id} for order in orders])
+    return orders
@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from foodcartapp import availability, search_index
+from foodcartapp.image_variants import has_image_variants
+from foodcartapp.jobs import enqueue
+from foodcartapp.models import Order, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from foodcartapp.place_distances import forget_restaurant_distances
+from foodcartapp.spatial_index import invalidate_restaurant_index
+from foodcartapp.views import invalidate_catalog
+
+
+@receiver(post_delete, sender=Restaurant)
+def rebuild_restaurant_index(sender, **kwargs):
+    # Другие процессы перечитают рестораны, как только увидят новую версию, поэтому сообщаем после коммита
+    transaction.on_commit(invalidate_restaurant_index)
+
+
+@receiver(post_save, sender=Restaurant)
+def reset_restaurant_distances(sender, instance, **kwargs):
+    # Смена названия или телефона расстояний не меняет, а сброс стоил бы пересчёта по всем адресам
+    if instance.has_location_changed():
+        forget_restaurant_distances([instance.id])
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def reset_order_candidates(sender, instance, **kwargs):
+    Order.objects.filter(pk=instance.order_id).update(candidates_version=None)
+
+
+@receiver(post_save, sender=Product)
+def build_product_image_variants(sender, instance, **kwargs):
+    # Уменьшенные копии готовит воркер, чтобы сохранение в админке не ждало Pillow
+    if instance.image and not has_image_variants(instance):
+        enqueue('build_image_variants', product_id=instance.id)
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+def update_menu_on_item_save(sender, instance, **kwargs):
+    availability.on_menu_item_saved(instance)
+
+
+@receiver(post_delete, sender=RestaurantMenuItem)
+def update_menu_on_item_delete(sender, instance, **kwargs):
+    availability.on_menu_item_deleted(instance.id)
+
+
+@receiver(post_delete, sender=Product)
+def update_menu_on_product_delete(sender, instance, **kwargs):
+    availability.on_product_deleted(instance.id)
+
+
+@receiver(post_delete, sender=Restaurant)
+def update_menu_on_restaurant_delete(sender, instance, **kwargs):
+    availability.on_restaurant_deleted(instance.id)
+
+
+@receiver(post_save, sender=Product)
+def update_search_on_product_save(sender, instance, **kwargs):
+    search_index.on_product_saved(instance.id)
+
+
+@receiver(post_delete, sender=Product)
+def update_search_on_product_delete(sender, instance, **kwargs):
+    search_index.on_product_deleted(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def update_search_on_category_change(sender, instance, **kwargs):
+    search_index.on_category_changed(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductCategory)
+@receiver([post_save, post_delete], sender=RestaurantMenuItem)
+def reset_catalog(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
@@ -0,0 +1,141 @@
+import math
+import time
+from collections import defaultdict
+
+from foodcartapp.cache_versions import VersionedCopy
+from foodcartapp.distances import EARTH_RADIUS_KM, rank_candidates
+
+
+RESTAURANT_INDEX_VERSION_KEY = 'foodcartapp:restaurant_index_version'
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+
+class RestaurantGrid:
+    """
+    Сетка из квадратов по широте и долготе, в каждом квадрате — рестораны, которые в него попали.
+    Чтобы найти рестораны рядом с заказом, достаточно посмотреть на соседние квадраты,
+    а не на все рестораны сети.
+    """
+
+    def __init__(self, points, cell_km=10, version=None):
+        """
+        :param points: словарь {restaurant_id: (lat, lon)}
+        :param cell_km: размер квадрата сетки в км
+        :param version: версия ресторанов, из которой собрана сетка
+        """
+        self.version = version
+        self.built_at = time.monotonic()
+        self.points = dict(points)
+        self.cell_km = cell_km
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self.cells = defaultdict(list)
+        for restaurant_id, (lat, lon) in self.points.items():
+            self.cells[self._get_cell(lat, lon)].append(restaurant_id)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _get_cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _get_cells_around(self, point, radius_km):
+        if radius_km is None or radius_km >= MAX_DISTANCE_KM:
+            return self.cells.keys()
+
+        lat, lon = point
+        lat_delta = radius_km / KM_PER_DEGREE
+        max_lat = min(abs(lat) + lat_delta, 90)
+        if max_lat >= 90:
+            lon_delta = 180
+        else:
+            lon_delta = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(max_lat))), 180)
+
+        min_row, min_column = self._get_cell(lat - lat_delta, lon - lon_delta)
+        max_row, max_column = self._get_cell(lat + lat_delta, lon + lon_delta)
+        cells_count = (max_row - min_row + 1) * (max_column - min_column + 1)
+        if lon_delta >= 180 or cells_count >= len(self.cells):
+            return self.cells.keys()
+
+        # Долгота замкнута: квадраты за 180-м меридианом переносим на другую сторону
+        columns_around_world = round(360 / self.cell_degrees)
+        cells = set()
+        for row in range(min_row, max_row + 1):
+            for column in range(min_column, max_column + 1):
+                for wrapped_column in (column, column - columns_around_world, column + columns_around_world):
+                    if (row, wrapped_column) in self.cells:
+                        cells.add((row, wrapped_column))
+        return cells
+
+    def _find_within(self, point, radius_km, allowed):
+        restaurant_ids = [
+            restaurant_id
+            for cell in self._get_cells_around(point, radius_km)
+            for restaurant_id in self.cells[cell]
+            if allowed is None or restaurant_id in allowed
+        ]
+        if not restaurant_ids:
+            return []
+
+        ranked = rank_candidates(
+            [point],
+            [self.points[restaurant_id] for restaurant_id in restaurant_ids],
+            [[True] * len(restaurant_ids)],
+        )[0]
+        return [
+            (restaurant_ids[column], distance)
+            for column, distance in ranked
+            if radius_km is None or distance <= radius_km
+        ]
+
+    def nearest(self, point, k=None, radius_km=None, allowed=None):
+        """
+        Ищет ближайшие к точке рестораны
+        :param point: (lat, lon)
+        :param k: сколько ресторанов вернуть, None — все подходящие
+        :param radius_km: дальше какого расстояния рестораны не рассматривать
+        :param allowed: id ресторанов, которые могут выполнить заказ; None — любые
+        :return: список (restaurant_id, км), сначала ближние
+        """
+        if k is None:
+            return self._find_within(point, radius_km, allowed)
+
+        # Расширяем круг поиска, пока в него не попадут k ресторанов.
+        # Всё, что осталось снаружи круга, заведомо дальше найденного.
+        max_radius_km = MAX_DISTANCE_KM if radius_km is None else radius_km
+        search_radius_km = min(self.cell_km, max_radius_km)
+        while True:
+            found = self._find_within(point, search_radius_km, allowed)
+            if len(found) >= k or search_radius_km >= max_radius_km:
+                return found[:k]
+            search_radius_km = min(search_radius_km * 2, max_radius_km)
+
+
+def load_restaurant_index(version):
+    from foodcartapp.models import Restaurant
+
+    points = Restaurant.objects.filter(lat__isnull=False, lon__isnull=False).values_list('id', 'lat', 'lon')
+    return RestaurantGrid({restaurant_id: (lat, lon) for restaurant_id, lat, lon in points}, version=version)
+
+
+_restaurant_index = VersionedCopy(RESTAURANT_INDEX_VERSION_KEY, load_restaurant_index, 'RESTAURANT_INDEX_MAX_AGE')
+
+
+def get_restaurant_index():
+    """
+    Возвращает индекс ресторанов с известными координатами. База читается только если рестораны
+    поменял какой-то процесс или индекс устарел, так же как в availability.get_menu_snapshot
+    """
+    return _restaurant_index.get()
+
+
+def reset_restaurant_index():
+    _restaurant_index.reset()
+
+
+def invalidate_restaurant_index(**kwargs):
+    """
+    Сообщает всем процессам, включая воркер run_jobs, что рестораны или их координаты изменились
+    """
+    _restaurant_index.invalidate()
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, которое называет файлы по SHA-256 их содержимого.
+    Одинаковые загрузки ложатся в один и тот же файл, а не в копии с суффиксами вроде burger_pympf5e.jpg.
+    """
+
+    def get_content_name(self, name, content):
+        """
+        Имя, под которым файл с таким содержимым лежит в хранилище
+        :param name: имя, предложенное Django, от него остаются каталог и расширение
+        :param content: содержимое файла
+        """
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, f'{digest.hexdigest()}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+product_images_storage = ContentAddressedStorage()
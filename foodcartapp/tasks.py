@@ -0,0 +1,27 @@
+from foodcartapp.candidates import refresh_order_candidates
+from foodcartapp.geocoder import get_coordinates
+from foodcartapp.image_variants import make_image_variants
+from foodcartapp.jobs import job
+from foodcartapp.models import Order, Product
+from foodcartapp.views import invalidate_catalog
+from star_burger import settings
+
+
+@job('geocode_order')
+def geocode_order(order_id):
+    order = Order.objects.prefetch_related('items', 'candidates').filter(pk=order_id).first()
+    if order is None:
+        return
+    get_coordinates(settings.YANDEX_KEY, order.address)
+    # Адрес уже в кэше, так что рестораны для заказа посчитаются без похода в геокодер
+    refresh_order_candidates([order], force=True)
+
+
+@job('build_image_variants')
+def build_image_variants(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return
+    if make_image_variants(product):
+        # Каталог мог успеть закэшироваться со ссылками только на полную картинку
+        invalidate_catalog()
@@ -0,0 +1,1193 @@
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib import admin as django_admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from geopy import distance
+from PIL import Image
+from requests import RequestException
+
+from star_burger import settings
+
+from . import (
+    availability, cache_versions, distances, geocoder, get_geo, idempotency, jobs, metrics, order_search,
+    search_index, tasks,
+)
+from .availability import get_menu_snapshot
+from .admin import RestaurantAdmin
+from .benchmarks import percentile
+from .custom_middleware import MetricsMiddleware
+from .load_replay import build_corpus, get_arrival_times, read_corpus, replay, summarize
+from .distances import get_distance_matrix, rank_candidates
+from .management.commands.bench import compare
+from .spatial_index import RESTAURANT_INDEX_VERSION_KEY, RestaurantGrid, get_restaurant_index, reset_restaurant_index
+from .fake_geocoder import get_fake_coordinates, start_fake_geocoder
+from .models import (
+    IdempotencyKey, Job, Order, OrderCandidate, OrderItem, Place, PlaceDistance, Product, ProductCategory, Restaurant,
+    RestaurantMenuItem,
+)
+from .place_distances import get_restaurant_distances
+from .serializer import OrderSerializer
+
+
+def create_order(products, address='Москва, Тверская 1'):
+    order = Order.objects.create(
+        firstname='Иван',
+        lastname='Петров',
+        phonenumber='+79991234567',
+        address=address,
+        totalprice=0,
+    )
+    for product in products:
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+    return order
+
+
+def fake_coordinates_many(apikey, addresses):
+    return {address: (55.75, 37.62) for address in addresses}
+
+
+class PrefetchItemsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        cls.roll = Product.objects.create(name='Ролл', price=200, image='roll.jpg')
+        cls.both = Restaurant.objects.create(name='Оба', address='Москва, Арбат 1', lat=55.75, lon=37.62)
+        cls.burgers_only = Restaurant.objects.create(name='Бургерная', address='Москва, Арбат 2', lat=55.76, lon=37.62)
+        RestaurantMenuItem.objects.create(restaurant=cls.both, product=cls.burger)
+        RestaurantMenuItem.objects.create(restaurant=cls.both, product=cls.roll)
+        RestaurantMenuItem.objects.create(restaurant=cls.burgers_only, product=cls.burger)
+        RestaurantMenuItem.objects.create(restaurant=cls.burgers_only, product=cls.roll, availability=False)
+
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        get_menu_snapshot()
+        # Рестораны созданы в setUpTestData, их транзакция не коммитится, и индекс сам не сбросится
+        reset_restaurant_index()
+        get_restaurant_index()
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            orders = list(Order.objects.prefetch_items())
+        return orders, len(queries)
+
+    @mock.patch('foodcartapp.place_distances.get_coordinates_many', side_effect=fake_coordinates_many)
+    def test_candidate_restaurants(self, _):
+        burger_order = create_order([self.burger])
+        full_order = create_order([self.burger, self.roll])
+
+        orders, _ = self.count_queries()
+        restaurants = {order.pk: order.restaurant_possible for order in orders}
+
+        self.assertEqual(restaurants[burger_order.pk], ['Оба - 0.0', 'Бургерная - 1.0'])
+        self.assertEqual(restaurants[full_order.pk], ['Оба - 0.0'])
+
+    @mock.patch('foodcartapp.place_distances.get_coordinates_many', side_effect=fake_coordinates_many)
+    def test_query_count_does_not_depend_on_orders(self, _):
+        create_order([self.burger, self.roll])
+        _, few_orders_queries = self.count_queries()
+
+        for _ in range(20):
+            create_order([self.burger, self.roll])
+        _, many_orders_queries = self.count_queries()
+
+        self.assertEqual(few_orders_queries, many_orders_queries)
+
+        # Ничего не поменялось — рестораны читаются из таблицы без пересчёта
+        _, cached_queries = self.count_queries()
+        self.assertLess(cached_queries, many_orders_queries)
+
+    @mock.patch('foodcartapp.place_distances.get_coordinates_many', side_effect=fake_coordinates_many)
+    def test_candidates_follow_menu_and_items(self, get_coordinates_many):
+        order = create_order([self.burger])
+        list(Order.objects.prefetch_items())
+        self.assertEqual(
+            set(OrderCandidate.objects.filter(order=order).values_list('restaurant', flat=True)),
+            {self.both.id, self.burgers_only.id},
+        )
+
+        # Меню поменялось, но не для продуктов заказа — геокодер не нужен
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(restaurant=self.burgers_only, product=self.roll).get().delete()
+        get_coordinates_many.reset_mock()
+        list(Order.objects.prefetch_items())
+        get_coordinates_many.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(restaurant=self.burgers_only, product=self.burger).update(
+                availability=False
+            )
+            availability.bump_menu_version()
+        orders = list(Order.objects.prefetch_items())
+        self.assertEqual(orders[0].restaurant_possible, ['Оба - 0.0'])
+
+        OrderItem.objects.create(order=order, product=self.roll, quantity=1, price=self.roll.price)
+        self.assertIsNone(Order.objects.get(pk=order.pk).candidates_version)
+
+    def test_geocoder_failure_is_retried(self):
+        order = create_order([self.burger])
+
+        with mock.patch('foodcartapp.place_distances.get_coordinates_many', return_value={}):
+            orders = list(Order.objects.prefetch_items())
+        self.assertCountEqual(orders[0].restaurant_possible, ['Оба - ?', 'Бургерная - ?'])
+        self.assertIsNone(Order.objects.get(pk=order.pk).candidates_version)
+        self.assertFalse(OrderCandidate.objects.filter(order=order).exists())
+
+        # Геокодер ожил — расстояния считаются на следующем же запросе
+        with mock.patch('foodcartapp.place_distances.get_coordinates_many', side_effect=fake_coordinates_many):
+            orders = list(Order.objects.prefetch_items())
+        self.assertEqual(orders[0].restaurant_possible, ['Оба - 0.0', 'Бургерная - 1.0'])
+        self.assertIsNotNone(Order.objects.get(pk=order.pk).candidates_version)
+
+
+class GeocoderCacheTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', return_value=(37.6, 55.7))
+    def test_address_is_geocoded_once(self, fetch_coordinates):
+        self.assertEqual(geocoder.get_coordinates('key', 'Москва,  Тверская 1'), (55.7, 37.6))
+        self.assertEqual(geocoder.get_coordinates('key', 'Москва, Тверская 1'), (55.7, 37.6))
+
+        geocoder.coordinates_cache.clear()
+        self.assertEqual(geocoder.get_coordinates('key', 'Москва, Тверская 1'), (55.7, 37.6))
+
+        fetch_coordinates.assert_called_once()
+        self.assertEqual(Place.objects.get().coordinates, (55.7, 37.6))
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', return_value=None)
+    def test_unknown_address_is_cached(self, fetch_coordinates):
+        self.assertIsNone(geocoder.get_coordinates('key', 'нигде'))
+        self.assertIsNone(geocoder.get_coordinates('key', 'нигде'))
+
+        fetch_coordinates.assert_called_once()
+
+
+class BatchGeocodingTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+        self.server = start_fake_geocoder(unknown_addresses=['нигде'], failures=2)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        patcher = mock.patch.multiple(settings, GEOCODER_URL=self.server.url, GEOCODER_RETRY_BACKOFF=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_geo._session = None
+        self.addCleanup(setattr, get_geo, '_session', None)
+
+    def test_fetch_coordinates_batch(self):
+        addresses = [f'Москва, Тверская {number}' for number in range(20)] + ['нигде']
+
+        with metrics.collect_request_stats() as stats:
+            found_coordinates = get_geo.fetch_coordinates_batch('key', addresses)
+
+        self.assertEqual(stats.geocoder_calls, len(addresses))
+
+        self.assertEqual(len(found_coordinates), len(addresses))
+        self.assertIsNone(found_coordinates['нигде'])
+        self.assertEqual(found_coordinates['Москва, Тверская 1'], get_fake_coordinates('Москва, Тверская 1'))
+        # Два первых ответа были ошибками, их запросы повторились
+        self.assertEqual(self.server.requests_count, len(addresses) + 2)
+
+    def test_cached_addresses_are_not_geocoded(self):
+        geocoder.get_coordinates_many('key', ['Москва, Арбат 1', 'нигде'])
+        requests_count = self.server.requests_count
+
+        coordinates = geocoder.get_coordinates_many('key', ['Москва, Арбат 1', 'нигде', 'Москва, Арбат 2'])
+
+        self.assertEqual(self.server.requests_count, requests_count + 1)
+        lon, lat = get_fake_coordinates('Москва, Арбат 1')
+        self.assertEqual(coordinates['Москва, Арбат 1'], (lat, lon))
+        self.assertIsNone(coordinates['нигде'])
+
+
+class GeocodeRestaurantsTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+        get_geo._session = None
+        self.addCleanup(setattr, get_geo, '_session', None)
+        self.arbat = Restaurant.objects.create(name='Арбат', address='Москва, Арбат 1', lat=55.75, lon=37.59)
+        self.tverskaya = Restaurant.objects.create(name='Тверская', address='Москва, Тверская 1')
+        self.nowhere = Restaurant.objects.create(name='Нигде', address='нигде', lat=1, lon=1)
+
+    def start_geocoder(self, **kwargs):
+        server = start_fake_geocoder(**kwargs)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        patcher = mock.patch.multiple(settings, GEOCODER_URL=server.url, GEOCODER_RETRY_BACKOFF=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def test_geocode_all(self):
+        self.start_geocoder(unknown_addresses=['нигде'])
+        output, errors = StringIO(), StringIO()
+
+        call_command('geocode_restaurants', all=True, stdout=output, stderr=errors)
+
+        lon, lat = get_fake_coordinates('Москва, Тверская 1')
+        self.tverskaya.refresh_from_db()
+        self.assertEqual(self.tverskaya.coordinates, (lat, lon))
+        self.nowhere.refresh_from_db()
+        self.assertIsNone(self.nowhere.coordinates)
+        self.assertIn('Обновлено ресторанов: 2', output.getvalue())
+        self.assertIn('нигде', errors.getvalue())
+
+    def test_only_missing_coordinates(self):
+        server = self.start_geocoder()
+
+        call_command('geocode_restaurants', stdout=StringIO())
+
+        self.assertEqual(server.requests_count, 1)
+        self.arbat.refresh_from_db()
+        self.assertEqual(self.arbat.coordinates, (55.75, 37.59))
+
+    def test_outage_keeps_coordinates(self):
+        self.start_geocoder(failures=1000)
+        errors = StringIO()
+
+        call_command('geocode_restaurants', all=True, stdout=StringIO(), stderr=errors)
+
+        self.arbat.refresh_from_db()
+        self.assertEqual(self.arbat.coordinates, (55.75, 37.59))
+        self.nowhere.refresh_from_db()
+        self.assertEqual(self.nowhere.coordinates, (1, 1))
+        self.assertIn('координаты не изменены', errors.getvalue())
+
+
+class RestaurantAdminTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+        self.restaurant_admin = RestaurantAdmin(Restaurant, django_admin.site)
+        self.request = RequestFactory().post('/admin/')
+        self.restaurant = Restaurant.objects.create(name='Арбат', address='Москва, Арбат 1', lat=55.75, lon=37.59)
+
+    def save(self, changed_data):
+        form = mock.Mock(changed_data=changed_data)
+        with mock.patch('foodcartapp.admin.messages') as messages:
+            self.restaurant_admin.save_model(self.request, self.restaurant, form, change=True)
+        self.restaurant.refresh_from_db()
+        return messages
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', return_value=(37.6, 55.7))
+    def test_address_change_is_geocoded(self, fetch_coordinates):
+        self.save(['name'])
+        fetch_coordinates.assert_not_called()
+        self.assertEqual(self.restaurant.coordinates, (55.75, 37.59))
+
+        self.restaurant.address = 'Москва, Тверская 1'
+        self.save(['address'])
+        fetch_coordinates.assert_called_once_with(settings.YANDEX_KEY, 'Москва, Тверская 1')
+        self.assertEqual(self.restaurant.coordinates, (55.7, 37.6))
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', side_effect=RequestException)
+    def test_geocoder_failure(self, fetch_coordinates):
+        self.restaurant.address = 'Москва, Тверская 1'
+        messages = self.save(['address'])
+
+        # Старые координаты относятся к старому адресу, оставлять их нельзя
+        self.assertIsNone(self.restaurant.coordinates)
+        messages.warning.assert_called_once()
+
+
+class DistanceMatrixTest(TestCase):
+    points = [(55.7558, 37.6173), (59.9386, 30.3141), (55.7963, 49.1088), (43.5855, 39.7231), (55.7601, 37.6186)]
+
+    def test_matches_geopy(self):
+        matrix = get_distance_matrix(self.points, self.points)
+
+        for row, point_from in enumerate(self.points):
+            for column, point_to in enumerate(self.points):
+                expected = distance.distance(point_from, point_to).km
+                self.assertAlmostEqual(
+                    matrix[row, column], expected,
+                    delta=expected * distances.RELATIVE_TOLERANCE + 1e-6,
+                )
+
+    def test_rank_candidates(self):
+        moscow, saint_petersburg, kazan, sochi, moscow_center = self.points
+        allowed = [
+            [True, True, False],
+            [True, True, True],
+            [True, True, True],
+        ]
+
+        ranked = rank_candidates([moscow, sochi, None], [kazan, moscow_center, saint_petersburg], allowed)
+
+        self.assertEqual([column for column, _ in ranked[0]], [1, 0])
+        self.assertLess(ranked[0][0][1], 1)
+        self.assertEqual([column for column, _ in ranked[1]], [1, 0, 2])
+        self.assertEqual(ranked[2], [(0, None), (1, None), (2, None)])
+
+
+class RestaurantGridTest(TestCase):
+    def test_nearest_matches_full_scan(self):
+        points = {
+            restaurant_id: (55 + restaurant_id % 17 * 0.05, 37 + restaurant_id % 23 * 0.07)
+            for restaurant_id in range(300)
+        }
+        points[1000] = (59.94, 30.31)
+        grid = RestaurantGrid(points, cell_km=5)
+        order_point = (55.4, 37.8)
+        allowed = set(range(0, 300, 3))
+
+        distances = get_distance_matrix([order_point], list(points.values()))[0]
+        full_scan = sorted(
+            (distance, restaurant_id)
+            for restaurant_id, distance in zip(points, distances)
+            if restaurant_id in allowed and distance <= 30
+        )
+
+        nearest = grid.nearest(order_point, k=5, radius_km=30, allowed=allowed)
+        self.assertEqual([restaurant_id for restaurant_id, _ in nearest], [item[1] for item in full_scan[:5]])
+
+        within_radius = grid.nearest(order_point, radius_km=30, allowed=allowed)
+        self.assertEqual(len(within_radius), len(full_scan))
+
+        self.assertEqual(grid.nearest((59.9, 30.3), k=1), [(1000, mock.ANY)])
+
+    def test_index_follows_other_processes(self):
+        cache.clear()
+        restaurant = Restaurant.objects.create(name='Ресторан', address='Москва, Арбат 1', lat=55.75, lon=37.62)
+        self.assertEqual(get_restaurant_index().points[restaurant.id], (55.75, 37.62))
+
+        # Другой процесс поменял координаты: сигнал до этого процесса не дошёл, дошла только версия в кэше
+        Restaurant.objects.filter(pk=restaurant.id).update(lat=59.94, lon=30.31)
+        cache_versions.bump_version(RESTAURANT_INDEX_VERSION_KEY)
+        self.assertEqual(get_restaurant_index().points[restaurant.id], (59.94, 30.31))
+
+        # Кэш у процессов свой, и версия не дошла: индекс всё равно перечитается, когда устареет
+        Restaurant.objects.filter(pk=restaurant.id).update(lat=55.75, lon=37.62)
+        self.assertEqual(get_restaurant_index().points[restaurant.id], (59.94, 30.31))
+        with mock.patch.object(settings, 'RESTAURANT_INDEX_MAX_AGE', -1):
+            self.assertEqual(get_restaurant_index().points[restaurant.id], (55.75, 37.62))
+
+
+class MenuSnapshotTest(TestCase):
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.restaurant = Restaurant.objects.create(name='Бургерная')
+
+    def test_snapshot_follows_menu_changes_without_queries(self):
+        self.assertNotIn(self.burger.id, get_menu_snapshot().available_products)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=self.burger)
+        with self.assertNumQueries(0):
+            snapshot = get_menu_snapshot()
+        self.assertEqual(snapshot.restaurants_by_product[self.burger.id], {self.restaurant.id})
+        self.assertEqual(Product.objects.available_in_bulk([self.burger.id, 0]), {self.burger.id: self.burger})
+
+        menu_item.availability = False
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.save()
+        with self.assertNumQueries(0):
+            self.assertNotIn(self.burger.id, get_menu_snapshot().available_products)
+        self.assertNotIn(self.restaurant.id, get_menu_snapshot().products_by_restaurant)
+
+    def test_other_process_change_reloads_snapshot(self):
+        get_menu_snapshot()
+        # Сигнал сработает только после коммита, поэтому снимок пока ничего не знает
+        RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=self.burger)
+        self.assertNotIn(self.burger.id, get_menu_snapshot().available_products)
+
+        availability.bump_menu_version()
+
+        self.assertIn(self.burger.id, get_menu_snapshot().available_products)
+
+
+class ProductListApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        availability.reset_menu_snapshot()
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        restaurant = Restaurant.objects.create(name='Бургерная')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+
+    def test_catalog_is_cached_with_etag(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.json()], ['Бургер'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.burger.name = 'Чизбургер'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.burger.save()
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'Чизбургер')
+
+    def test_bulk_menu_change_refreshes_catalog(self):
+        etag = self.client.get('/api/products/')['ETag']
+
+        # Массовое обновление не отправляет сигналы, о нём сообщают только версией меню
+        RestaurantMenuItem.objects.update(availability=False)
+        availability.bump_menu_version()
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_catalog_expires(self):
+        with mock.patch.object(settings, 'CATALOG_CACHE_TIMEOUT', -1):
+            etag = self.client.get('/api/products/')['ETag']
+        # Товар поменяли в другом процессе, а общего кэша, через который пришла бы новая версия, нет
+        Product.objects.filter(pk=self.burger.pk).update(name='Чизбургер')
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Чизбургер')
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        availability.reset_menu_snapshot()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_product(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), 'red').save(buffer, 'JPEG')
+        product = Product(name='Бургер', price=100)
+        product.image.save('burger.jpg', ContentFile(buffer.getvalue()), save=False)
+        product.save()
+        RestaurantMenuItem.objects.create(restaurant=Restaurant.objects.create(name='Бургерная'), product=product)
+        return product
+
+    def test_variants_are_built_by_job_and_listed_in_catalog(self):
+        product = self.create_product()
+        job = Job.objects.get(name='build_image_variants')
+
+        # Пока воркер не сделал копии, каталог отдаёт исходную картинку и сам Pillow не трогает
+        catalog = self.client.get('/api/products/').json()
+        self.assertEqual(catalog[0]['image_variants'], {})
+        self.assertEqual(catalog[0]['image'], product.image.url)
+        self.assertFalse(default_storage.exists('variants'))
+
+        tasks.build_image_variants(**job.payload)
+
+        product.refresh_from_db()
+        card = product.image_variants['card']
+        self.assertEqual(set(card), {'jpeg', 'webp'})
+        with default_storage.open(card['webp']) as image_file:
+            self.assertEqual(Image.open(image_file).size, (800, 400))
+
+        catalog = self.client.get('/api/products/').json()
+        self.assertEqual(catalog[0]['image_variants']['card']['webp'], default_storage.url(card['webp']))
+
+    def test_same_image_reuses_variants(self):
+        first = self.create_product()
+        second = self.create_product()
+        # Хранилище само склеивает одинаковые загрузки, а здесь проверяем копии, сделанные для разных имён
+        second.image.name = 'copy_of_burger.jpg'
+        default_storage.save(second.image.name, first.image)
+        second.save()
+        jobs.run_pending_jobs()
+
+        catalog = self.client.get('/api/products/').json()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(catalog[0]['image_variants'], catalog[1]['image_variants'])
+        self.assertEqual(first.image_variants['list'], second.image_variants['list'])
+
+    def test_backfill_enqueues_products_without_variants(self):
+        product = self.create_product()
+        jobs.run_pending_jobs()
+        stale_product = self.create_product()
+        Product.objects.filter(pk=stale_product.pk).update(image_variants={})
+        Job.objects.all().delete()
+        output = StringIO()
+
+        call_command('backfill_image_variants', batch_size=1, stdout=output)
+
+        self.assertIn('Поставлено в очередь товаров: 1', output.getvalue())
+        self.assertEqual([job.payload for job in Job.objects.all()], [{'product_id': stale_product.id}])
+        self.assertTrue(Product.objects.get(pk=product.pk).image_variants)
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = Product._meta.get_field('image').storage
+        # Хранилище создаётся при импорте моделей: если оно не заметит подмену MEDIA_ROOT, тесты насорят в media/
+        self.assertEqual(self.storage.location, media_root.name)
+
+    def test_identical_uploads_share_one_file(self):
+        first = Product(name='Бургер', price=100)
+        first.image.save('burger.jpg', ContentFile(b'burger'))
+        second = Product(name='Чизбургер', price=120)
+        second.image.save('burger.JPG', ContentFile(b'burger'))
+        third = Product(name='Ролл', price=200)
+        third.image.save('burger.jpg', ContentFile(b'roll'))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertEqual(len(self.storage.listdir('')[1]), 2)
+
+    def test_dedupe_media_rewrites_references(self):
+        for name in ('beconizer.jpg', 'beconizer_pympf5e.jpg', 'unknown.jpg'):
+            with open(self.storage.path(name), 'wb') as file:
+                file.write(b'unknown' if name == 'unknown.jpg' else b'beconizer')
+        first = Product.objects.create(name='Беконайзер', price=100, image='beconizer.jpg')
+        second = Product.objects.create(name='Беконайзер XL', price=150, image='beconizer_pympf5e.jpg')
+
+        call_command('dedupe_media', stdout=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.read(), b'beconizer')
+        self.assertCountEqual(self.storage.listdir('')[1], [first.image.name, 'unknown.jpg'])
+
+
+class OrderSerializerTest(TestCase):
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        restaurant = Restaurant.objects.create(name='Бургерная')
+        self.products = [
+            Product.objects.create(name=f'Бургер {number}', price=100 + number, image='burger.jpg')
+            for number in range(10)
+        ]
+        for product in self.products:
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+        get_menu_snapshot()
+
+    def validate_order(self, products):
+        serializer = OrderSerializer(data={
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79991234567',
+            'address': 'Москва, Тверская 1',
+            'products': [{'product': product.id, 'quantity': 2} for product in products],
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    def test_validation_sends_only_ordered_products_to_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.validate_order(self.products[:2])
+
+        self.assertEqual(len(queries), 1)
+        ordered_ids = ', '.join(str(product.id) for product in self.products[:2])
+        self.assertIn(f'IN ({ordered_ids})', queries[0]['sql'])
+
+    def test_order_is_written_once_with_total(self):
+        serializer = self.validate_order(self.products)
+        # Точка сохранения транзакции, заказ, все позиции одним запросом, фоновая задача, снятие точки сохранения
+        with self.assertNumQueries(5):
+            order = serializer.create(serializer.validated_data)
+
+        expected_total = sum(product.price * 2 for product in self.products)
+        self.assertEqual(Order.objects.get(pk=order.pk).totalprice, expected_total)
+        self.assertEqual(order.items.count(), len(self.products))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Order.objects.with_total_coast().get(pk=order.pk).get_total_coast(), expected_total)
+        with self.assertNumQueries(2):
+            order = Order.objects.prefetch_related('items').get(pk=order.pk)
+            self.assertEqual(order.get_total_coast(), expected_total)
+
+    def test_products_are_validated_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.validate_order(self.products[:1])
+        with self.assertNumQueries(1):
+            self.validate_order(self.products)
+
+    def test_unavailable_product_is_rejected(self):
+        hidden_product = Product.objects.create(name='Секретный бургер', price=1, image='burger.jpg')
+        serializer = OrderSerializer(data={
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79991234567',
+            'address': 'Москва, Тверская 1',
+            'products': [
+                {'product': self.products[0].id, 'quantity': 1},
+                {'product': hidden_product.id, 'quantity': 1},
+            ],
+        })
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['products'][0], {})
+        self.assertIn('product', serializer.errors['products'][1])
+
+
+class BulkOrdersApiTest(TestCase):
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        restaurant = Restaurant.objects.create(name='Бургерная')
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+
+    def get_payload(self, number, product_id=None):
+        return {
+            'firstname': 'Иван',
+            'lastname': f'Петров {number}',
+            'phonenumber': '+79991234567',
+            'address': 'Москва, Тверская 1',
+            'products': [{'product': product_id or self.burger.id, 'quantity': 2}],
+        }
+
+    def test_json_lines(self):
+        payloads = [self.get_payload(1), self.get_payload(2, product_id=999), self.get_payload(3)]
+        body = '\n'.join(json.dumps(payload, ensure_ascii=False) for payload in payloads)
+
+        response = self.client.post('/api/orders/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (2, 1))
+        self.assertIn('products', result['results'][1]['errors'])
+        order = Order.objects.get(pk=result['results'][2]['id'])
+        self.assertEqual(order.lastname, 'Петров 3')
+        self.assertEqual(order.totalprice, 200)
+        self.assertEqual(order.items.get().quantity, 2)
+
+    def test_duplicated_product_is_rejected(self):
+        duplicated = self.get_payload(2)
+        duplicated['products'].append({'product': self.burger.id, 'quantity': 1})
+
+        response = self.client.post(
+            '/api/orders/bulk/', [self.get_payload(1), duplicated], content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (1, 1))
+        self.assertEqual(result['results'][1]['errors']['products'][0], {})
+        self.assertIn('product', result['results'][1]['errors']['products'][1])
+        self.assertEqual(Order.objects.get().lastname, 'Петров 1')
+
+    def test_product_lookups_do_not_depend_on_order_count(self):
+        get_menu_snapshot()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/orders/bulk/', [self.get_payload(1)], content_type='application/json')
+        product_queries = [query for query in queries if 'FROM "foodcartapp_product"' in query['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            payloads = [self.get_payload(number) for number in range(50)]
+            self.client.post('/api/orders/bulk/', payloads, content_type='application/json')
+        self.assertEqual(
+            len([query for query in queries if 'FROM "foodcartapp_product"' in query['sql']]),
+            len(product_queries),
+        )
+        self.assertEqual(Order.objects.count(), 51)
+
+
+class IdempotencyTest(TestCase):
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        idempotency.responses_cache.clear()
+        restaurant = Restaurant.objects.create(name='Бургерная')
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+        self.payload = {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79991234567',
+            'address': 'Москва, Тверская 1',
+            'products': [{'product': self.burger.id, 'quantity': 1}],
+        }
+
+    def post_order(self, key):
+        return self.client.post('/api/order/', self.payload, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_stored_response(self):
+        response = self.post_order('retry-1')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            retry = self.post_order('retry-1')
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        idempotency.responses_cache.clear()
+        with self.assertNumQueries(1):
+            self.post_order('retry-1')
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.post_order('retry-2')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_another_order_is_rejected(self):
+        self.post_order('reused')
+        self.payload['products'][0]['quantity'] = 2
+
+        response = self.post_order('reused')
+        self.assertEqual(response.status_code, 422)
+
+        idempotency.responses_cache.clear()
+        response = self.post_order('reused')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cached_key_expires_with_stored_key(self):
+        self.post_order('old')
+        idempotency.responses_cache.clear()
+        IdempotencyKey.objects.filter(key='old').update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL - 60),
+        )
+
+        with mock.patch('foodcartapp.lru_cache.time.monotonic', return_value=time.monotonic()) as monotonic:
+            self.assertEqual(self.post_order('old')['Idempotent-Replayed'], 'true')
+            # Минуту спустя ключ просрочен и в памяти процесса, хотя туда попал только что
+            monotonic.return_value += 61
+            self.assertIsNone(idempotency.responses_cache.get('old'))
+
+    def test_concurrent_duplicate_is_rolled_back(self):
+        self.post_order('race')
+        idempotency.responses_cache.clear()
+
+        with mock.patch('foodcartapp.views.get_stored_response', return_value=None):
+            response = self.post_order('race')
+
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+        self.order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address='Москва, Тверская 1',
+            totalprice=0,
+        )
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', return_value=(37.6, 55.7))
+    def test_order_address_is_geocoded_by_worker(self, fetch_coordinates):
+        jobs.enqueue('geocode_order', order_id=self.order.id)
+
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        self.assertEqual(Place.objects.get(name='Москва, Тверская 1').coordinates, (55.7, 37.6))
+        self.assertEqual(jobs.run_pending_jobs(), 0)
+
+    @mock.patch('foodcartapp.geocoder.fetch_coordinates', side_effect=RequestException)
+    def test_failed_job_is_retried_later(self, fetch_coordinates):
+        job = jobs.enqueue('geocode_order', order_id=self.order.id)
+
+        jobs.run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('RequestException', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(jobs.run_pending_jobs(), 0)
+
+        Job.objects.update(run_after=timezone.now(), attempts=settings.JOB_MAX_ATTEMPTS - 1)
+        jobs.run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_old_finished_jobs_are_cleared(self):
+        old_done = jobs.enqueue('geocode_order', order_id=self.order.id)
+        old_failed = jobs.enqueue('geocode_order', order_id=self.order.id)
+        recent_done = jobs.enqueue('geocode_order', order_id=self.order.id)
+        pending = jobs.enqueue('geocode_order', order_id=self.order.id)
+        long_ago = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS + 1)
+        Job.objects.filter(pk=old_done.pk).update(status=Job.DONE, finished_at=long_ago)
+        Job.objects.filter(pk=old_failed.pk).update(status=Job.FAILED, finished_at=long_ago)
+        Job.objects.filter(pk=recent_done.pk).update(status=Job.DONE, finished_at=timezone.now())
+        output = StringIO()
+
+        call_command('clear_jobs', stdout=output)
+
+        self.assertIn('Удалено задач: 2', output.getvalue())
+        self.assertCountEqual(Job.objects.values_list('pk', flat=True), [recent_done.pk, pending.pk])
+
+
+class PlaceDistanceTest(TestCase):
+    def setUp(self):
+        geocoder.coordinates_cache.clear()
+        reset_restaurant_index()
+        self.restaurant = Restaurant.objects.create(name='Бургерная', address='Москва, Арбат 1', lat=55.75, lon=37.59)
+
+    @mock.patch('foodcartapp.get_geo.fetch_coordinates', return_value=(37.62, 55.75))
+    def test_distances_are_cached_per_place(self, _):
+        restaurants_by_address = {'Москва, Тверская 1': {self.restaurant.id}}
+
+        distances = get_restaurant_distances(restaurants_by_address)
+
+        distance_km = distances['Москва, Тверская 1'][self.restaurant.id]
+        self.assertAlmostEqual(distance_km, 1.88, places=1)
+        self.assertEqual(PlaceDistance.objects.get().distance, distance_km)
+
+        with mock.patch('foodcartapp.place_distances.get_restaurant_index') as get_restaurant_index:
+            self.assertEqual(get_restaurant_distances(restaurants_by_address), distances)
+        get_restaurant_index.return_value.nearest.assert_not_called()
+
+        # Название на расстояния не влияет, посчитанное остаётся
+        order = create_order([])
+        Order.objects.filter(pk=order.pk).update(candidates_version=1)
+        restaurant = Restaurant.objects.get(pk=self.restaurant.id)
+        restaurant.name = 'Бургерная на Арбате'
+        restaurant.save()
+        self.assertTrue(PlaceDistance.objects.exists())
+        self.assertEqual(Order.objects.get(pk=order.pk).candidates_version, 1)
+
+        restaurant.address = 'Москва, Арбат 10'
+        restaurant.save()
+        self.assertFalse(PlaceDistance.objects.exists())
+        self.assertIsNone(Order.objects.get(pk=order.pk).candidates_version)
+
+    @mock.patch('foodcartapp.get_geo.fetch_coordinates', return_value=(37.62, 55.75))
+    def test_geocode_restaurants_forgets_distances(self, _):
+        get_restaurant_distances({'Москва, Тверская 1': {self.restaurant.id}})
+        self.assertTrue(PlaceDistance.objects.exists())
+
+        with mock.patch('foodcartapp.geocoder.fetch_coordinates_batch', return_value={'Москва, Арбат 1': (37.6, 55.7)}):
+            call_command('geocode_restaurants', all=True, stdout=StringIO())
+
+        self.assertFalse(PlaceDistance.objects.exists())
+
+    @mock.patch('foodcartapp.get_geo.fetch_coordinates', return_value=(37.62, 55.75))
+    def test_regeocoded_place_forgets_distances(self, _):
+        get_restaurant_distances({'Москва, Тверская 1': {self.restaurant.id}})
+        place = Place.objects.get()
+
+        # Координаты те же, пересчитывать нечего
+        geocoder.save_coordinates(place.name, (55.75, 37.62))
+        self.assertTrue(PlaceDistance.objects.exists())
+
+        geocoder.save_coordinates(place.name, (55.76, 37.62))
+        self.assertFalse(PlaceDistance.objects.exists())
+
+
+class BenchTest(SimpleTestCase):
+    def test_percentile(self):
+        timings = list(range(1, 101))
+        self.assertEqual(percentile(timings, 50), 50)
+        self.assertEqual(percentile(timings, 99), 99)
+        self.assertEqual(percentile([7], 90), 7)
+
+    def test_compare_with_baseline(self):
+        baseline = {'results': {'view_products': {'p50_ms': 10, 'p90_ms': 20, 'peak_memory_kb': 100, 'queries': 2}}}
+        results = {'view_products': {'p50_ms': 11, 'p90_ms': 30, 'peak_memory_kb': 100, 'queries': 3}}
+
+        comparison, regressions = compare(results, baseline, threshold=0.2)
+
+        self.assertEqual(comparison['view_products']['p50_ms']['change'], 0.1)
+        self.assertEqual(regressions, ['view_products.p90_ms: 20 → 30', 'view_products.queries: 2 → 3'])
+
+
+@mock.patch.object(settings, 'METRICS_TOKEN', 'secret')
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        availability.reset_menu_snapshot()
+
+    def get_metrics(self):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_requests_are_measured(self):
+        self.client.get('/api/products/')
+
+        response = self.get_metrics()
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        view = 'view="foodcartapp.views.product_list_api"'
+        self.assertRegex(content, f'http_requests_total{{{view},method="GET",status="200"}} [1-9]')
+        self.assertIn(f'http_request_duration_seconds_bucket{{{view},method="GET",le="+Inf"}}', content)
+        self.assertIn(f'http_request_db_queries_count{{{view}}}', content)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.get_metrics().status_code, 200)
+
+        with mock.patch.object(settings, 'METRICS_TOKEN', None):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer None').status_code, 403)
+
+    def test_slow_requests_are_logged(self):
+        with mock.patch.object(settings, 'SLOW_REQUEST_THRESHOLD_MS', 0):
+            with self.assertLogs('foodcartapp.custom_middleware', 'WARNING') as logs:
+                self.client.get('/api/products/')
+        self.assertIn('foodcartapp.views.product_list_api', logs.output[0])
+
+    def test_streaming_responses_are_measured_to_the_end(self):
+        def stream():
+            yield b'first'
+            Product.objects.count()
+            yield b'second'
+
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse(stream()))
+        response = middleware(RequestFactory().get('/stream/'))
+        with mock.patch.object(metrics, 'record_request') as record_request:
+            self.assertEqual(b''.join(response.streaming_content), b'firstsecond')
+
+        record_request.assert_called_once()
+        view, method, status, duration, stats = record_request.call_args.args
+        self.assertEqual((view, method, status), ('unmatched', 'GET', 200))
+        self.assertEqual(stats.queries, 1)
+
+    @mock.patch.object(metrics, 'start_dumping')
+    def test_metrics_are_shared_between_processes(self, start_dumping):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        dead_process = subprocess.Popen(['true'])
+        dead_process.wait()
+        view = 'view="foodcartapp.views.product_list_api"'
+        with mock.patch.object(settings, 'METRICS_DIR', metrics_dir.name):
+            self.client.get('/api/products/')
+            start_dumping.assert_called()
+            content = self.get_metrics().content.decode()
+            count = int(re.search(rf'http_requests_total{{{view},method="GET",status="200"}} (\d+)', content)[1])
+
+            # Метрики выложили другой живой воркер и воркер, который уже завершился
+            for pid, requests_count in [(os.getppid(), 5), (dead_process.pid, 100)]:
+                (Path(metrics_dir.name) / f'metrics-{pid}-other.json').write_text(json.dumps({
+                    'http_requests_total': [[['foodcartapp.views.product_list_api', 'GET', '200'], requests_count]],
+                }))
+            content = self.get_metrics().content.decode()
+
+        self.assertIn(f'http_requests_total{{{view},method="GET",status="200"}} {count + 5}', content)
+        self.assertFalse((Path(metrics_dir.name) / f'metrics-{dead_process.pid}-other.json').exists())
+
+    def test_histogram_render(self):
+        histogram = metrics.Histogram('test_seconds', 'Тест', [0.1, 1], ['view'])
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, view='a"b')
+
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{view="a\\"b",le="1"} 2',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 3',
+            'test_seconds_sum{view="a\\"b"} 5.55',
+            'test_seconds_count{view="a\\"b"} 3',
+        ])
+
+
+class LoadReplayTest(LiveServerTestCase):
+    def setUp(self):
+        cache.clear()
+        availability.reset_menu_snapshot()
+        restaurant = Restaurant.objects.create(name='Ресторан', address='Москва, Арбат 1', lat=55.75, lon=37.62)
+        for name in ['Бургер', 'Ролл']:
+            product = Product.objects.create(name=name, price=100, image='burger.jpg')
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+
+    def test_replay(self):
+        corpus = build_corpus(20, order_share=0.3, banner_share=0.2, seed=1)
+        orders_count = sum(entry['name'] == 'register_order' for entry in corpus)
+
+        # В тестах SQLite в памяти, и сервер делит с тестом одно соединение, поэтому запросы по одному
+        results, elapsed = replay(corpus, self.live_server_url, concurrency=1, requests_count=25)
+        report = summarize(results, elapsed)
+
+        self.assertEqual(report['total']['requests'], 25)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(set(report['by_name']), {'banners_list_api', 'product_list_api', 'register_order'})
+        # Корпус проигрывается по кругу, первые пять запросов ушли дважды
+        repeated_orders = sum(entry['name'] == 'register_order' for entry in corpus[:5])
+        self.assertEqual(Order.objects.count(), orders_count + repeated_orders)
+
+    def test_errors_are_counted(self):
+        results, elapsed = replay(
+            [{'name': 'missing', 'path': '/api/missing/'}], self.live_server_url, concurrency=1, requests_count=2,
+        )
+
+        self.assertEqual(summarize(results, elapsed)['total']['error_rate'], 1)
+
+
+class LoadCorpusTest(SimpleTestCase):
+    def test_read_corpus(self):
+        corpus = read_corpus(['{"path": "/api/products/"}', '', '{"path": "/api/banners/", "method": "GET"}'])
+
+        self.assertEqual([entry['path'] for entry in corpus], ['/api/products/', '/api/banners/'])
+        with self.assertRaisesMessage(ValueError, 'Строка 2'):
+            read_corpus(['{"path": "/api/products/"}', '{"method": "GET"}'])
+
+    def test_arrival_times(self):
+        self.assertEqual(get_arrival_times(3, rate=4, arrival='constant'), [0, 0.25, 0.5])
+
+        arrival_times = get_arrival_times(10000, rate=100, seed=1)
+        # У пуассоновского потока средний промежуток тот же, что у равномерного
+        self.assertAlmostEqual(arrival_times[-1] / len(arrival_times), 0.01, delta=0.001)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        availability.reset_menu_snapshot()
+        search_index.reset_product_index()
+        self.restaurant = Restaurant.objects.create(name='Ресторан', address='Москва, Арбат 1', lat=55.75, lon=37.62)
+        self.burgers = ProductCategory.objects.create(name='Бургеры')
+        self.cheeseburger = self.create_product('Чизбургер', 'Булочка, котлета и сыр чеддер', self.burgers)
+        self.burger = self.create_product('Бургер с ёршиком', 'Классика', self.burgers)
+        self.roll = self.create_product('Ролл', 'С курицей. Подаётся с бургерным соусом', None)
+
+    def create_product(self, name, description, category, available=True):
+        product = Product.objects.create(
+            name=name, description=description, category=category, price=100, image='burger.jpg',
+        )
+        RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=product, availability=available)
+        return product
+
+    def search(self, query):
+        response = self.client.get('/api/products/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.json()]
+
+    def test_casefold_and_prefix(self):
+        self.assertEqual(self.search('БУРГ')[0], 'Бургер с ёршиком')
+        self.assertEqual(self.search('ершик'), ['Бургер с ёршиком'])
+        self.assertEqual(self.search('ЧЕДДЕР'), ['Чизбургер'])
+
+    def test_ranking_and_typos(self):
+        # Совпадение в названии выше совпадения в категории, а то выше описания
+        self.assertEqual(self.search('бургер'), ['Бургер с ёршиком', 'Чизбургер', 'Ролл'])
+        self.assertEqual(self.search('чизбурегр'), ['Чизбургер'])
+        self.assertEqual(self.search('бургер сыр'), ['Чизбургер'])
+        self.assertEqual(self.search('пицца'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.search('ролл'), ['Ролл'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roll.name = 'Шаурма'
+            self.roll.save()
+            self.burgers.name = 'Котлеты'
+            self.burgers.save()
+            self.create_product('Ролл с лососем', '', None)
+            self.create_product('Ролл с угрём', '', None, available=False)
+
+        self.assertEqual(self.search('ролл'), ['Ролл с лососем'])
+        self.assertEqual(self.search('шаурма'), ['Шаурма'])
+        self.assertEqual(self.search('котлеты'), ['Чизбургер', 'Бургер с ёршиком'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.burgers.delete()
+            self.cheeseburger.delete()
+
+        self.assertEqual(self.search('котлеты'), [])
+        self.assertNotIn('Чизбургер', self.search('чизбургер'))
+
+    def test_incremental_update_keeps_index(self):
+        index = search_index.get_product_index()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Картошка фри', '', None)
+
+        self.assertIs(search_index.get_product_index(), index)
+        self.assertEqual([product_id for product_id, _ in index.search('картошка')], [Product.objects.last().id])
+
+    def test_index_expires(self):
+        index = search_index.get_product_index()
+        # Товар поменяли в другом процессе, а общего кэша, через который пришла бы новая версия, нет
+        Product.objects.filter(pk=self.roll.pk).update(name='Шаурма')
+        self.assertIs(search_index.get_product_index(), index)
+
+        with mock.patch.object(settings, 'SEARCH_INDEX_MAX_AGE', -1):
+            self.assertEqual(self.search('шаурма'), ['Шаурма'])
+
+    def test_admin_search(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+        response = self.client.get('/admin/foodcartapp/product/', {'q': 'бург'})
+
+        self.assertEqual(
+            {product.name for product in response.context['cl'].result_list},
+            {'Чизбургер', 'Бургер с ёршиком', 'Ролл'},
+        )
+
+
+class OrderSearchTest(TestCase):
+    def setUp(self):
+        self.petrov = create_order([])
+        self.sidorova = Order.objects.create(
+            firstname='Алёна', lastname='Сидорова', phonenumber='+74951234567', address='Москва', totalprice=0,
+        )
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def search(self, query):
+        response = self.client.get('/admin/foodcartapp/order/', {'q': query})
+        return {order.id for order in response.context['cl'].result_list}
+
+    def test_keys_are_filled_on_save(self):
+        self.assertEqual(self.sidorova.phone_key, '+74951234567')
+        self.assertEqual(self.sidorova.name_key, 'сидорова алена')
+
+        self.sidorova.lastname = 'Иванова'
+        self.sidorova.save(update_fields=['lastname'])
+        self.sidorova.refresh_from_db()
+        self.assertEqual(self.sidorova.name_key, 'иванова алена')
+
+    def test_phone_lookup(self):
+        self.assertEqual(order_search.get_phone_prefix('8 (999) 12'), '+799912')
+        self.assertIsNone(order_search.get_phone_prefix('Петров'))
+        self.assertIsNone(order_search.get_phone_prefix('4567'))
+        self.assertEqual(order_search.get_phone_prefix('(999) 12'), '+799912')
+
+        for query in ['+7 999 123-45-67', '89991234567', '9991234567', '8 (999) 123', '+7999']:
+            self.assertEqual(self.search(query), {self.petrov.id}, query)
+        self.assertEqual(self.search('495'), set())
+        # Городской номер без кода страны находится, только если набран целиком
+        self.assertEqual(self.search('4951234567'), {self.sidorova.id})
+        self.assertEqual(self.search('495 123'), set())
+        self.assertEqual(self.search('+7 495 123'), {self.sidorova.id})
+
+    def test_name_lookup(self):
+        self.assertEqual(self.search('ПЕТРОВ'), {self.petrov.id})
+        self.assertEqual(self.search('сидорова ален'), {self.sidorova.id})
+        self.assertEqual(self.search('Алена Сидорова'), {self.sidorova.id})
+        self.assertEqual(self.search('Иван'), set())
+        self.assertEqual(self.search(''), {self.petrov.id, self.sidorova.id})
+
+    def test_lookups_use_indexes(self):
+        sql = str(Order.objects.filter(order_search.get_orders_lookup('8 999 123')).query)
+
+        self.assertIn('LIKE', sql)
+        self.assertNotIn('UPPER', sql)
+        self.assertNotIn('%+799912%', sql)
+
+    def test_backfill(self):
+        Order.objects.update(phone_key='', name_key='')
+        output = StringIO()
+
+        call_command('backfill_order_search_keys', batch_size=1, stdout=output)
+
+        self.assertIn('Обновлено заказов: 2', output.getvalue())
+        self.assertEqual(self.search('+79991234567'), {self.petrov.id})
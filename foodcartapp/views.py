@@ -1,11 +1,35 @@
-from django.http import JsonResponse
+import hashlib
+import hmac
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.templatetags.static import static
+from django.utils.cache import get_conditional_response
 
-from .models import Product
+from .image_variants import get_image_variant_urls
+from .metrics import render_metrics
+from .availability import get_menu_snapshot, get_menu_version
+from .cache_versions import bump_version, get_version
+from .idempotency import IDEMPOTENCY_HEADER, IdempotencyKeyReused, get_request_hash, get_stored_response, run_once
+from .models import IdempotencyKey, Product
+from .search_index import get_product_index
+from rest_framework import status
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
 
-from .serializer import OrderSerializer
+from star_burger import settings
+from .parsers import JSONLinesParser
+from .serializer import OrderSerializer, create_orders, get_available_products
+
+
+CATALOG_CACHE_KEY = 'foodcartapp:catalog'
+CATALOG_VERSION_KEY = 'foodcartapp:catalog_version'
+SEARCH_RESULTS_LIMIT = 20
+SEARCH_RESULTS_MAX_LIMIT = 100
 
 
 def banners_list_api(request):
@@ -32,41 +56,156 @@ def banners_list_api(request):
     })
 
 
-def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
+def serialize_product(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'special_status': product.special_status,
+        'description': product.description,
+        'category': {
+            'id': product.category.id,
+            'name': product.category.name,
+        } if product.category else None,
+        'image': product.image.url,
+        'image_variants': get_image_variant_urls(product),
+        'restaurant': {
             'id': product.id,
             'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
         }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    }
+
+
+def get_catalog():
+    """
+    Возвращает каталог уже сериализованным в JSON вместе с его ETag.
+    Каталог лежит в кэше, пока не поменяются товары, категории или меню ресторанов: версии входят в ключ,
+    так что устаревший каталог не достанется ни одному процессу. А если кэш у каждого процесса свой
+    и об изменениях в других процессах он не узнает, каталог всё равно живёт не дольше CATALOG_CACHE_TIMEOUT.
+    :return: (байты JSON, ETag)
+    """
+    cache_key = f'{CATALOG_CACHE_KEY}:{get_version(CATALOG_VERSION_KEY)}:{get_menu_version()}'
+    catalog = cache.get(cache_key)
+    if catalog is not None:
+        return catalog
+
+    products = Product.objects.select_related('category').available_in_bulk()
+    dumped_products = [serialize_product(products[product_id]) for product_id in sorted(products)]
+
+    content = json.dumps(dumped_products, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+    catalog = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+    cache.set(cache_key, catalog, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return catalog
+
+
+def invalidate_catalog():
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def metrics_api(request):
+    # Метрики выдают устройство сайта, поэтому без токена страница закрыта
+    authorization = request.headers.get('Authorization', '')
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def product_list_api(request):
+    content, etag = get_catalog()
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def product_search_api(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_RESULTS_LIMIT)), SEARCH_RESULTS_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'limit': ['Ожидается целое число.']}, status=400)
+    if limit < 1:
+        return JsonResponse({'limit': ['Должно быть не меньше 1.']}, status=400)
+
+    # Ищем только среди того, что сейчас в продаже, как и в каталоге
+    found = get_product_index().search(query, allowed=get_menu_snapshot().available_products)[:limit]
+    products = Product.objects.select_related('category').in_bulk([product_id for product_id, _ in found])
+    return JsonResponse(
+        [
+            {**serialize_product(products[product_id]), 'score': round(score, 3)}
+            for product_id, score in found
+            if product_id in products
+        ],
+        safe=False,
+        json_dumps_params={'ensure_ascii': False},
+    )
 
 
 # Забираем данные заказа/проверяем валидность
 @api_view(['POST'])
 def register_order(request):
-    serializer = OrderSerializer(data=request.data)
+    idempotency_key = request.META.get(IDEMPOTENCY_HEADER)
+    if idempotency_key is None:
+        return Response(create_order(request.data))
+
+    if len(idempotency_key) > IdempotencyKey._meta.get_field('key').max_length:
+        raise ValidationError({'Idempotency-Key': ['Слишком длинный ключ.']})
+
+    request_hash = get_request_hash(request.data)
+    try:
+        # Повтор уже обработанного запроса: отдаём сохранённый ответ, ничего не проверяя и не создавая
+        stored_response = get_stored_response(idempotency_key, request_hash)
+        if stored_response is not None:
+            return Response(stored_response, headers={'Idempotent-Replayed': 'true'})
+
+        response, created = run_once(idempotency_key, request_hash, lambda: create_order(request.data))
+    except IdempotencyKeyReused:
+        return Response(
+            {'Idempotency-Key': ['Ключ уже использован для другого запроса.']},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    headers = {} if created else {'Idempotent-Replayed': 'true'}
+    return Response(response, headers=headers)
+
+
+def create_order(data):
+    serializer = OrderSerializer(data=data)
     serializer.is_valid(raise_exception=True)
     order = serializer.create(serializer.validated_data)
     serializer = OrderSerializer(order)
 
-    return Response(serializer.data)
+    return serializer.data
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, JSONLinesParser])
+def register_orders_bulk(request):
+    payloads = request.data
+    if not isinstance(payloads, list):
+        raise ValidationError('Ожидается список заказов или JSON Lines.')
+    if len(payloads) > settings.BULK_ORDERS_MAX_COUNT:
+        raise ValidationError(f'За один запрос можно передать не больше {settings.BULK_ORDERS_MAX_COUNT} заказов.')
+
+    context = {'available_products': get_available_products(payloads)}
+    results = []
+    valid_orders = []
+    for index, payload in enumerate(payloads):
+        serializer = OrderSerializer(data=payload, context=context)
+        if serializer.is_valid():
+            result = {'index': index}
+            valid_orders.append((result, serializer.validated_data))
+        else:
+            result = {'index': index, 'errors': serializer.errors}
+        results.append(result)
 
+    chunk_size = settings.BULK_ORDERS_CHUNK_SIZE
+    for chunk_start in range(0, len(valid_orders), chunk_size):
+        chunk = valid_orders[chunk_start:chunk_start + chunk_size]
+        orders = create_orders([validated_data for _, validated_data in chunk])
+        for (result, _), order in zip(chunk, orders):
+            result['id'] = order.id
+
+    return Response({
+        'created': len(valid_orders),
+        'failed': len(payloads) - len(valid_orders),
+        'results': results,
+    })
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from foodcartapp.models import Product, ProductCategory, Restaurant, RestaurantMenuItem
+from restaurateur.views import invalidate_products_table
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductCategory)
+@receiver([post_save, post_delete], sender=Restaurant)
+@receiver([post_save, post_delete], sender=RestaurantMenuItem)
+def reset_products_table(sender, **kwargs):
+    transaction.on_commit(invalidate_products_table)
@@ -1,3 +1,204 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from foodcartapp import availability
+from foodcartapp.models import Order, Product, Restaurant, RestaurantMenuItem
+from restaurateur.views import EVENT_CURSOR_PARSERS, decode_cursor
+from star_burger import settings
+
+
+def fake_coordinates_many(apikey, addresses):
+    return {address: (55.75, 37.62) for address in addresses}
+
+
+@mock.patch('foodcartapp.place_distances.get_coordinates_many', fake_coordinates_many)
+class ViewOrdersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', password='secret', is_staff=True)
+        cls.restaurant = Restaurant.objects.create(name='Бургерная', address='Москва, Арбат 1')
+        cls.orders = []
+        for number in range(7):
+            cls.orders.append(Order.objects.create(
+                firstname=f'Клиент {number}',
+                lastname='Петров',
+                phonenumber='+79991234567',
+                address='Москва, Тверская 1',
+                totalprice=0,
+                status=Order.COOKING if number % 3 == 0 else Order.NEW,
+                payment=Order.CASH if number % 2 else Order.CASHLESS,
+            ))
+        Order.objects.create(
+            firstname='Доставлен', lastname='Петров', phonenumber='+79991234567',
+            address='Москва, Тверская 1', totalprice=0, status=Order.READY,
+        )
+
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        self.client.force_login(self.manager)
+
+    def fetch_all_pages(self, url):
+        order_ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            order_ids.extend(order.id for order in response.context['order_items'])
+            next_page_url = response.context['next_page_url']
+            url = reverse('restaurateur:view_orders') + next_page_url if next_page_url else None
+        return order_ids
+
+    def test_pages_cover_all_open_orders_once(self):
+        with mock.patch.object(settings, 'ORDERS_PAGE_SIZE', 3):
+            order_ids = self.fetch_all_pages(reverse('restaurateur:view_orders'))
+
+        expected_ids = list(
+            Order.objects.active().order_by(*Order.DASHBOARD_ORDERING).values_list('id', flat=True)
+        )
+        self.assertEqual(order_ids, expected_ids)
+        self.assertEqual(len(order_ids), len(self.orders))
+
+    def test_filters(self):
+        self.orders[1].restaurant = self.restaurant
+        self.orders[1].save()
+        url = reverse('restaurateur:view_orders')
+
+        with mock.patch.object(settings, 'ORDERS_PAGE_SIZE', 2):
+            cash_ids = self.fetch_all_pages(f'{url}?payment={Order.CASH}')
+            cooking_ids = self.fetch_all_pages(f'{url}?status={Order.COOKING}')
+        restaurant_ids = self.fetch_all_pages(f'{url}?restaurant={self.restaurant.id}')
+
+        self.assertCountEqual(cash_ids, [order.id for order in self.orders if order.payment == Order.CASH])
+        self.assertCountEqual(cooking_ids, [order.id for order in self.orders if order.status == Order.COOKING])
+        self.assertEqual(restaurant_ids, [self.orders[1].id])
+
+
+class ViewProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('manager', password='secret', is_staff=True))
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.roll = Product.objects.create(name='Ролл', price=200, image='roll.jpg')
+        self.arbat = Restaurant.objects.create(name='Арбат', address='Москва, Арбат 1')
+        self.tverskaya = Restaurant.objects.create(name='Тверская', address='Москва, Тверская 1')
+        RestaurantMenuItem.objects.create(restaurant=self.arbat, product=self.burger, availability=True)
+        RestaurantMenuItem.objects.create(restaurant=self.tverskaya, product=self.burger, availability=False)
+
+    def test_table_is_cached_until_menu_changes(self):
+        url = reverse('restaurateur:ProductsView')
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode().count('#menu-item-available"'), 1)
+
+        with self.assertNumQueries(2):
+            # Сессия и пользователь, таблица берётся из кэша
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.create(restaurant=self.tverskaya, product=self.roll, availability=True)
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode().count('#menu-item-available"'), 2)
+
+    def test_table_follows_other_processes(self):
+        url = reverse('restaurateur:ProductsView')
+        self.client.get(url)
+
+        # Массовое обновление меню в другом процессе: сигналов нет, есть только новая версия меню
+        RestaurantMenuItem.objects.update(availability=True)
+        availability.bump_menu_version()
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode().count('#menu-item-available"'), 2)
+
+    def test_table_expires(self):
+        url = reverse('restaurateur:ProductsView')
+        with mock.patch.object(settings, 'PRODUCTS_TABLE_CACHE_TIMEOUT', -1):
+            self.client.get(url)
+        # Меню поменяли в другом процессе, а общего кэша, через который пришла бы новая версия, нет
+        RestaurantMenuItem.objects.update(availability=True)
+
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode().count('#menu-item-available"'), 2)
+
+
+def read_events(response, count=None):
+    events = []
+    for chunk in response.streaming_content:
+        lines = chunk.decode().strip().splitlines()
+        if lines and lines[0].startswith('id: '):
+            fields = dict(line.split(': ', 1) for line in lines)
+            events.append((fields['event'], json.loads(fields['data']), fields['id']))
+            if len(events) == count:
+                break
+    response.close()
+    return events
+
+
+@mock.patch('foodcartapp.place_distances.get_coordinates_many', fake_coordinates_many)
+@mock.patch.object(settings, 'ORDERS_STREAM_POLL_INTERVAL', 0.01)
+@mock.patch.object(settings, 'ORDERS_STREAM_OVERLAP', 0)
+class StreamOrdersTest(TestCase):
+    def setUp(self):
+        availability.reset_menu_snapshot()
+        manager = User.objects.create_user('manager', password='secret', is_staff=True)
+        self.client.force_login(manager)
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79991234567',
+            address='Москва, Тверская 1', totalprice=0,
+        )
+
+    def test_stream_resumes_from_last_event_id(self):
+        page = self.client.get(reverse('restaurateur:view_orders'))
+        self.order.status = Order.COOKING
+        self.order.save()
+        new_order = Order.objects.create(
+            firstname='Анна', lastname='Иванова', phonenumber='+79991234568',
+            address='Москва, Тверская 2', totalprice=0,
+        )
+
+        response = self.client.get(page.context['stream_url'])
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        (changed, changed_data, _), (created, created_data, created_id) = read_events(response, 2)
+
+        self.assertEqual((changed, changed_data['id']), ('changed', self.order.id))
+        self.assertIn('Готовится', changed_data['html'])
+        self.assertEqual((created, created_data['id']), ('created', new_order.id))
+
+        new_order.status = Order.READY
+        new_order.save()
+        response = self.client.get(reverse('restaurateur:stream_orders'), HTTP_LAST_EVENT_ID=created_id)
+        self.assertEqual(read_events(response, 1), [
+            ('changed', {'id': new_order.id, 'version': new_order.updated_at.isoformat(), 'html': ''}, mock.ANY),
+        ])
+
+    def test_late_commits_are_not_skipped(self):
+        self.order.registration_date = timezone.now() - timedelta(hours=1)
+        self.order.save()
+        page = self.client.get(reverse('restaurateur:view_orders'))
+        self.order.status = Order.COOKING
+        self.order.save()
+        # Заказ из транзакции, которая закоммитилась позже, чем ему проставили время изменения
+        late_order = Order.objects.create(
+            firstname='Анна', lastname='Иванова', phonenumber='+79991234568',
+            address='Москва, Тверская 2', totalprice=0,
+        )
+        Order.objects.filter(pk=late_order.pk).update(
+            registration_date=timezone.now() - timedelta(seconds=30),
+            updated_at=timezone.now() - timedelta(seconds=30),
+        )
+
+        # Поток читается до конца: каждая версия заказа отдаётся один раз, хотя окно перечитывается на каждом опросе
+        with mock.patch.multiple(settings, ORDERS_STREAM_OVERLAP=60, ORDERS_STREAM_DURATION=0.1):
+            events = read_events(self.client.get(page.context['stream_url']))
 
-# Create your tests here.
+        self.assertEqual(
+            [(event, data['id']) for event, data, _ in events],
+            [('created', late_order.id), ('changed', self.order.id)],
+        )
+        # Курсор не откатывается назад из-за опоздавшего заказа
+        late_order.refresh_from_db()
+        self.assertGreater(decode_cursor(events[0][2], EVENT_CURSOR_PARSERS)[0], late_order.updated_at)
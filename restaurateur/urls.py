@@ -12,8 +12,8 @@ urlpatterns = [
 
     path('restaurants/', views.view_restaurants, name="RestaurantView"),
 
-    # TODO заглушка для нереализованного функционала
     path('orders/', views.view_orders, name="view_orders"),
+    path('orders/stream/', views.stream_orders, name="stream_orders"),
 
     path('login/', views.LoginView.as_view(), name="login"),
     path('logout/', views.LogoutView.as_view(), name="logout"),
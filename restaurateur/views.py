@@ -1,12 +1,26 @@
+import json
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+
+import numpy as np
 from django import forms
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.views import View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
+from django.utils import timezone
 
-from foodcartapp.models import Product, Restaurant, Order
+from foodcartapp.availability import get_menu_version
+from foodcartapp.cache_versions import bump_version, get_version
+from foodcartapp.models import Product, Restaurant, RestaurantMenuItem, Order, OrderCandidate
+from star_burger import settings
 
 
 class Login(forms.Form):
@@ -61,24 +75,57 @@ def is_manager(user):
     return user.is_staff  # FIXME replace with specific permission
 
 
-@user_passes_test(is_manager, login_url='restaurateur:login')
-def view_products(request):
-    restaurants = list(Restaurant.objects.order_by('name'))
-    products = list(Product.objects.prefetch_related('menu_items'))
+PRODUCTS_TABLE_CACHE_KEY = 'restaurateur:products_table'
+PRODUCTS_TABLE_VERSION_KEY = 'restaurateur:products_table_version'
 
-    products_with_restaurant_availability = []
-    for product in products:
-        availability = {item.restaurant_id: item.availability for item in product.menu_items.all()}
-        ordered_availability = [availability.get(restaurant.id, False) for restaurant in restaurants]
 
-        products_with_restaurant_availability.append(
-            (product, ordered_availability)
-        )
+def get_availability_matrix(products, restaurants):
+    """
+    Одним запросом собирает, какие продукты продаются в каких ресторанах
+    :param products: продукты, строки таблицы
+    :param restaurants: рестораны, столбцы таблицы
+    :return: numpy-массив bool размером продукты × рестораны
+    """
+    rows = {product.id: row for row, product in enumerate(products)}
+    columns = {restaurant.id: column for column, restaurant in enumerate(restaurants)}
+    matrix = np.zeros((len(rows), len(columns)), dtype=bool)
+    menu_items = RestaurantMenuItem.objects.filter(availability=True).values_list('product_id', 'restaurant_id')
+    for product_id, restaurant_id in menu_items.iterator():
+        if product_id in rows and restaurant_id in columns:
+            matrix[rows[product_id], columns[restaurant_id]] = True
+    return matrix
 
-    return render(request, template_name="products_list.html", context={
-        'products_with_restaurant_availability': products_with_restaurant_availability,
+
+def get_products_table():
+    """
+    Возвращает отрисованную таблицу меню. Она лежит в кэше, пока не поменяются продукты, рестораны или меню,
+    а если кэш у каждого процесса свой, то не дольше PRODUCTS_TABLE_CACHE_TIMEOUT
+    """
+    cache_key = f'{PRODUCTS_TABLE_CACHE_KEY}:{get_version(PRODUCTS_TABLE_VERSION_KEY)}:{get_menu_version()}'
+    table = cache.get(cache_key)
+    if table is not None:
+        return table
+
+    restaurants = list(Restaurant.objects.order_by('name').only('id', 'name'))
+    products = list(Product.objects.select_related('category'))
+    matrix = get_availability_matrix(products, restaurants)
+    table = render_to_string('products_table.html', {
+        'products_with_restaurant_availability': zip(products, matrix),
         'restaurants': restaurants,
     })
+    cache.set(cache_key, table, timeout=settings.PRODUCTS_TABLE_CACHE_TIMEOUT)
+    return table
+
+
+def invalidate_products_table():
+    bump_version(PRODUCTS_TABLE_VERSION_KEY)
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_products(request):
+    return render(request, template_name="products_list.html", context={
+        'products_table': get_products_table(),
+    })
 
 
 @user_passes_test(is_manager, login_url='restaurateur:login')
@@ -88,8 +135,217 @@ def view_restaurants(request):
     })
 
 
+class OrdersFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Все')] + [choice for choice in Order.ORDER_STATUS if choice[0] != Order.READY],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    restaurant = forms.ModelChoiceField(
+        label='Ресторан', required=False, empty_label='Все',
+        queryset=Restaurant.objects.order_by('name'),
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    payment = forms.ChoiceField(
+        label='Оплата', required=False,
+        choices=[('', 'Все')] + Order.PAYMENT_METHOD,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    date_from = forms.DateField(
+        label='С', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    date_to = forms.DateField(
+        label='По', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+
+    def filter(self, orders):
+        if not self.is_valid():
+            return orders
+        filters = self.cleaned_data
+        if filters['status']:
+            orders = orders.filter(status=filters['status'])
+        if filters['payment']:
+            orders = orders.filter(payment=filters['payment'])
+        if filters['restaurant']:
+            # Ресторан, которому заказ уже передан, или который может его приготовить
+            candidates = OrderCandidate.objects.filter(order=OuterRef('pk'), restaurant=filters['restaurant'])
+            orders = orders.filter(Q(restaurant=filters['restaurant']) | Q(Exists(candidates)))
+        if filters['date_from']:
+            orders = orders.filter(registration_date__gte=start_of_day(filters['date_from']))
+        if filters['date_to']:
+            orders = orders.filter(registration_date__lt=start_of_day(filters['date_to'] + timedelta(days=1)))
+        return orders
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def encode_cursor(*values):
+    return urlsafe_b64encode('|'.join(str(value) for value in values).encode()).decode()
+
+
+def decode_cursor(cursor, parsers):
+    """
+    Разбирает курсор из encode_cursor
+    :param cursor: строка из запроса
+    :param parsers: функции, которые превращают части курсора обратно в значения
+    :return: кортеж значений или None, если курсор испорчен
+    """
+    try:
+        values = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if len(values) != len(parsers):
+            return None
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except ValueError:
+        return None
+
+
+PAGE_CURSOR_PARSERS = [str, datetime.fromisoformat, int]
+
+
+def get_orders_after(orders, cursor):
+    """
+    Заказы после курсора в порядке Order.DASHBOARD_ORDERING. В отличие от OFFSET, база
+    сразу переходит к нужному месту индекса, и страница стоит одинаково, сколько бы заказов ни было
+    """
+    status, registration_date, order_id = cursor
+    return orders.filter(
+        Q(status__lt=status)
+        | Q(status=status, registration_date__lt=registration_date)
+        | Q(status=status, registration_date=registration_date, id__lt=order_id)
+    )
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_orders(request):
-    orders = list(Order.objects.exclude(status=Order.READY).order_by('-status'))
-    context = {'order_items': orders}
+    orders_filter = OrdersFilter(request.GET)
+    orders = orders_filter.filter(Order.objects.all())
+
+    cursor = decode_cursor(request.GET.get('after', ''), PAGE_CURSOR_PARSERS)
+    if cursor:
+        orders = get_orders_after(orders, cursor)
+
+    page_size = settings.ORDERS_PAGE_SIZE
+    # Берём на один заказ больше, чтобы узнать, есть ли следующая страница
+    orders = orders.prefetch_items(limit=page_size + 1)
+    next_page_url = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        query = request.GET.copy()
+        last_order = orders[-1]
+        query['after'] = encode_cursor(last_order.status, last_order.registration_date.isoformat(), last_order.id)
+        next_page_url = f'?{query.urlencode()}'
+
+    first_page_query = request.GET.copy()
+    first_page_query.pop('after', None)
+    # Всё, что поменяется после загрузки страницы, придёт через stream_orders
+    stream_query = first_page_query.copy()
+    stream_query['last_event_id'] = encode_cursor(timezone.now().isoformat(), 0)
+    context = {
+        'order_items': orders,
+        'filter_form': orders_filter,
+        'next_page_url': next_page_url,
+        'first_page_url': f'?{first_page_query.urlencode()}' if cursor else None,
+        'stream_url': f'{reverse("restaurateur:stream_orders")}?{stream_query.urlencode()}',
+    }
     return render(request, template_name='order_items.html', context=context)
+
+
+EVENT_CURSOR_PARSERS = [datetime.fromisoformat, int]
+ORDER_EVENTS_BATCH_SIZE = 100
+
+
+def get_order_changes(since, after=None):
+    """
+    Заказы, изменившиеся не раньше since, в порядке изменения
+    :param after: (updated_at, id) заказа, после которого читать, чтобы идти по окну пачками
+    """
+    changes = Order.objects.filter(updated_at__gte=since).order_by('updated_at', 'id')
+    if after is not None:
+        updated_at, order_id = after
+        changes = changes.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=order_id))
+    return changes
+
+
+def iterate_order_changes(since):
+    after = None
+    while True:
+        changed_orders = list(get_order_changes(since, after)[:ORDER_EVENTS_BATCH_SIZE])
+        yield from changed_orders
+        if len(changed_orders) < ORDER_EVENTS_BATCH_SIZE:
+            return
+        after = (changed_orders[-1].updated_at, changed_orders[-1].id)
+
+
+def format_event(event, data, event_id):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def generate_order_events(orders_filter, cursor):
+    """
+    Опрашивает базу и отдаёт изменения заказов в формате Server-Sent Events.
+    created — заказ появился недавно и его может не быть на странице, changed — заказ поменялся.
+    В data лежит новая строка таблицы; пустая строка значит, что заказ больше не показывается.
+
+    updated_at ставится до коммита, поэтому заказ из долгой транзакции, например из пачки /api/orders/bulk/,
+    появляется в базе с уже прошедшим временем. Чтобы не перескочить через него, каждый опрос перечитывает
+    окно ORDERS_STREAM_OVERLAP секунд до курсора, а уже отданные версии заказов пропускает.
+    :param cursor: (updated_at, id) последнего отданного изменения
+    """
+    yield f'retry: {int(settings.ORDERS_STREAM_POLL_INTERVAL * 1000)}\n\n'
+    overlap = timedelta(seconds=settings.ORDERS_STREAM_OVERLAP)
+    created_since = cursor[0] - overlap
+    sent_versions = {}
+    # Соединение ограничено по времени, чтобы не занимать воркер навсегда, браузер переподключится сам
+    deadline = time.monotonic() + settings.ORDERS_STREAM_DURATION
+    while time.monotonic() < deadline:
+        window_start = cursor[0] - overlap
+        sent_versions = {
+            order_id: updated_at for order_id, updated_at in sent_versions.items() if updated_at >= window_start
+        }
+        changed_orders = [
+            order for order in iterate_order_changes(window_start)
+            if sent_versions.get(order.id) != order.updated_at
+        ]
+        if not changed_orders:
+            # Комментарий не даёт прокси закрыть соединение по таймауту
+            yield ': ping\n\n'
+            time.sleep(settings.ORDERS_STREAM_POLL_INTERVAL)
+            continue
+
+        shown_orders = {
+            order.id: order
+            for order in orders_filter.filter(Order.objects.filter(id__in=[order.id for order in changed_orders]))
+            .prefetch_items()
+        }
+        for order in changed_orders:
+            event = 'created' if order.registration_date > created_since else 'changed'
+            html = ''
+            if order.id in shown_orders:
+                html = render_to_string('order_row.html', {'item': shown_orders[order.id]})
+            sent_versions[order.id] = order.updated_at
+            # Id события — самое позднее из отданных изменений: после переподключения окно отсчитается от него
+            cursor = max(cursor, (order.updated_at, order.id))
+            event_id = encode_cursor(cursor[0].isoformat(), cursor[1])
+            data = {'id': order.id, 'version': order.updated_at.isoformat(), 'html': html}
+            yield format_event(event, data, event_id)
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def stream_orders(request):
+    event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id', '')
+    cursor = decode_cursor(event_id, EVENT_CURSOR_PARSERS)
+    if not cursor:
+        cursor = (timezone.now(), 0)
+
+    response = StreamingHttpResponse(
+        generate_order_events(OrdersFilter(request.GET), cursor),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Без этого nginx копит ответ в буфере и события доходят пачками
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -37,9 +37,22 @@ INSTALLED_APPS = [
 
 YANDEX_KEY = env('YANDEX_KEY')
 
+DELIVERY_RADIUS_KM = env.float('DELIVERY_RADIUS_KM', None)
+ORDER_CANDIDATES_LIMIT = env.int('ORDER_CANDIDATES_LIMIT', None)
+
+GEOCODER_URL = env('GEOCODER_URL', 'https://geocode-maps.yandex.ru/1.x')
+GEOCODER_TIMEOUT = env.float('GEOCODER_TIMEOUT', 5)
+GEOCODER_RETRIES = env.int('GEOCODER_RETRIES', 3)
+GEOCODER_RETRY_BACKOFF = env.float('GEOCODER_RETRY_BACKOFF', 0.3)
+GEOCODER_MAX_WORKERS = env.int('GEOCODER_MAX_WORKERS', 8)
+GEOCODER_CACHE_SIZE = env.int('GEOCODER_CACHE_SIZE', 10000)
+GEOCODER_CACHE_TTL = env.int('GEOCODER_CACHE_TTL', 30 * 24 * 60 * 60)
+GEOCODER_NEGATIVE_CACHE_TTL = env.int('GEOCODER_NEGATIVE_CACHE_TTL', 24 * 60 * 60)
+
 POST_SERVER_ITEM_ACCESS_TOKEN = env('POST_SERVER_ITEM_ACCESS_TOKEN')
 
 MIDDLEWARE = [
+    'foodcartapp.custom_middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +65,19 @@ MIDDLEWARE = [
     # 'star-burger.foodcartapp.custom_middleware.URLProtectionMiddleware'
 ]
 
+CACHES = {
+    'default': {
+        'BACKEND': env('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CACHE_LOCATION', ''),
+    }
+}
+
+MENU_SNAPSHOT_MAX_AGE = env.int('MENU_SNAPSHOT_MAX_AGE', 5 * 60)
+RESTAURANT_INDEX_MAX_AGE = env.int('RESTAURANT_INDEX_MAX_AGE', 5 * 60)
+SEARCH_INDEX_MAX_AGE = env.int('SEARCH_INDEX_MAX_AGE', 5 * 60)
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', 5 * 60)
+PRODUCTS_TABLE_CACHE_TIMEOUT = env.int('PRODUCTS_TABLE_CACHE_TIMEOUT', 5 * 60)
+
 ROOT_URLCONF = 'star_burger.urls'
 
 DEBUG_TOOLBAR_PANELS = [
@@ -148,6 +174,27 @@ if not DEBUG:
         ),
     }
 
+METRICS_TOKEN = env('METRICS_TOKEN', None)
+METRICS_DIR = env('METRICS_DIR', None)
+METRICS_DUMP_INTERVAL = env.float('METRICS_DUMP_INTERVAL', 5)
+SLOW_REQUEST_THRESHOLD_MS = env.int('SLOW_REQUEST_THRESHOLD_MS', None)
+
+ORDERS_PAGE_SIZE = env.int('ORDERS_PAGE_SIZE', 50)
+ORDERS_STREAM_POLL_INTERVAL = env.float('ORDERS_STREAM_POLL_INTERVAL', 2)
+ORDERS_STREAM_DURATION = env.int('ORDERS_STREAM_DURATION', 60)
+ORDERS_STREAM_OVERLAP = env.int('ORDERS_STREAM_OVERLAP', 5 * 60)
+
+BULK_ORDERS_MAX_COUNT = env.int('BULK_ORDERS_MAX_COUNT', 5000)
+BULK_ORDERS_CHUNK_SIZE = env.int('BULK_ORDERS_CHUNK_SIZE', 500)
+
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+IDEMPOTENCY_CACHE_SIZE = env.int('IDEMPOTENCY_CACHE_SIZE', 10000)
+
+JOB_MAX_ATTEMPTS = env.int('JOB_MAX_ATTEMPTS', 5)
+JOB_RETRY_DELAY = env.int('JOB_RETRY_DELAY', 30)
+JOB_LOCK_TIMEOUT = env.int('JOB_LOCK_TIMEOUT', 10 * 60)
+JOB_RETENTION_DAYS = env.int('JOB_RETENTION_DAYS', 7)
+
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'rollbar.contrib.django_rest_framework.post_exception_handler'
 }